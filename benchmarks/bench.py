@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @desc    : 性能测试, 在本地模拟服务(mock_server.py)上运行, 结果追加到历史结果文件并与上次比较
+#
+#   python benchmarks/bench.py                      # 全部
+#   python benchmarks/bench.py startup send         # 指定项目
+#   python benchmarks/bench.py --quick --fail-on-regression
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from work_weixin import Client, MemoryTokenStore  # noqa: E402
+from work_weixin.transport import Transport  # noqa: E402
+
+RESULTS = os.environ.get('WORK_WEIXIN_BENCH_RESULTS') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'work_weixin', 'bench-results.jsonl')
+'''历史结果, 默认写在源码目录之外, 可由环境变量 WORK_WEIXIN_BENCH_RESULTS 或 --results 指定'''
+
+
+def new_client(url: str, pool_size: int = 10, **kwargs) -> Client:
+    # 每次新的 token 存储: 默认的进程内存储会复用上一个模拟服务发放的 token
+    return Client('corpid', 'secret', 1, transport=Transport(base_url=url, pool_size=pool_size),
+                  token_store=MemoryTokenStore(), **kwargs)
+
+
+class Server(object):
+    """在子进程中启动 mock_server.py, 避免与被测代码争用 GIL"""
+
+    def __init__(self, *args):
+        self.process = subprocess.Popen([sys.executable, os.path.join(HERE, 'mock_server.py')] + [str(a) for a in args],
+                                        stdout=subprocess.PIPE, universal_newlines=True)
+        self.url: str = self.process.stdout.readline().strip()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def bench_startup(sizes: list, repeat: int):
+    """Client() 构造及首次加载通讯录的耗时, 与通讯录大小的关系"""
+    for users in sizes:
+        departments = max(users // 50, 1)
+        with Server('--users', users, '--departments', departments) as server:
+            construct, load = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                client = new_client(server.url)
+                construct.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                assert len(client.users) == users
+                load.append(time.perf_counter() - started)
+                client.close()
+        yield {'users': users, 'departments': departments}, {
+            'construct_s': statistics.median(construct), 'directory_s': statistics.median(load)}
+
+
+def bench_send(levels: list, count: int, latency: float):
+    """send_text_touser 在不同并发下的吞吐及延迟; 以及一次发给大量司员时的分批并发"""
+    with Server('--latency', latency) as server:
+        for concurrency in levels:
+            client = new_client(server.url, concurrency, load_directory=False)
+            elapsed = []
+
+            def send(i):
+                started = time.perf_counter()
+                client.send_text_touser('user{}'.format(i), 'benchmark')
+                elapsed.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(send, range(count)))
+            total = time.perf_counter() - started
+            client.close()
+            yield {'case': 'touser', 'concurrency': concurrency, 'latency': latency}, {
+                'msgs_per_s': count / total, 'p50_s': percentile(elapsed, 0.5), 'p99_s': percentile(elapsed, 0.99)}
+
+        touser = ['user{}'.format(i) for i in range(count * 10)]
+        for workers in levels:
+            client = new_client(server.url, workers, load_directory=False, send_workers=workers)
+            started = time.perf_counter()
+            client.send_msg(touser=touser, content={'content': 'benchmark'})
+            total = time.perf_counter() - started
+            client.close()
+            yield {'case': 'fanout', 'recipients': len(touser), 'send_workers': workers, 'latency': latency}, {
+                'recipients_per_s': len(touser) / total, 'total_s': total}
+
+
+def bench_upload(sizes: list):
+    """upload_tmp 的吞吐及内存峰值(tracemalloc)"""
+    with Server() as server:
+        client = new_client(server.url, load_directory=False)
+        for size in sizes:
+            fd, path = tempfile.mkstemp(suffix='.bin')
+            try:
+                chunk = os.urandom(1 << 20)
+                with os.fdopen(fd, 'wb') as f:
+                    for _ in range(size >> 20):
+                        f.write(chunk)
+                tracemalloc.start()
+                started = time.perf_counter()
+                client.upload_tmp(path)
+                total = time.perf_counter() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            finally:
+                os.unlink(path)
+            yield {'size': size}, {'mb_per_s': size / (1 << 20) / total, 'peak_bytes': peak}
+        client.close()
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith('_per_s')
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_history(path: str) -> dict:
+    """{(bench, params): 最近一次的 metrics}"""
+    history = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                history[(record['bench'], json.dumps(record['params'], sort_keys=True))] = record['metrics']
+    return history
+
+
+def compare(previous: dict, metrics: dict, threshold: float) -> list:
+    """与上次结果比较, 返回变差超过 threshold 的指标"""
+    regressions = []
+    for metric, value in metrics.items():
+        old = (previous or {}).get(metric)
+        if not old:
+            continue
+        change = (old - value) / old if higher_is_better(metric) else (value - old) / old
+        if change > threshold:
+            regressions.append('{} {:.4g} -> {:.4g} ({:+.0%})'.format(metric, old, value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='work_weixin 性能测试')
+    parser.add_argument('benches', nargs='*', default=['startup', 'send', 'upload'])
+    parser.add_argument('--quick', action='store_true', help='缩小规模, 用于 CI')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟接口延迟(秒)')
+    parser.add_argument('--results', default=RESULTS, help='历史结果文件(JSON lines)')
+    parser.add_argument('--no-save', action='store_true', help='不写入历史结果')
+    parser.add_argument('--threshold', type=float, default=0.15, help='变差超过该比例视为退化')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有退化时以状态码 1 退出')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        benches = {'startup': lambda: bench_startup([1000, 10000], 3),
+                   'send': lambda: bench_send([1, 16], 200, args.latency),
+                   'upload': lambda: bench_upload([16 << 20])}
+    else:
+        benches = {'startup': lambda: bench_startup([1000, 10000, 100000], 5),
+                   'send': lambda: bench_send([1, 8, 32, 64], 2000, args.latency),
+                   'upload': lambda: bench_upload([16 << 20, 256 << 20])}
+
+    history = load_history(args.results)
+    run = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version()}
+    regressions = []
+    if not args.no_save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(os.devnull if args.no_save else args.results, 'a', encoding='utf-8') as out:
+        for name in args.benches:
+            for params, metrics in benches[name]():
+                key = (name, json.dumps(params, sort_keys=True))
+                worse = compare(history.get(key), metrics, args.threshold)
+                regressions += ['{} {}: {}'.format(name, key[1], w) for w in worse]
+                print('{:8} {:60} {}{}'.format(name, key[1], '  '.join(
+                    '{}={:.4g}'.format(k, v) for k, v in metrics.items()), '  REGRESSION' if worse else ''))
+                out.write(json.dumps(dict(run, bench=name, params=params, metrics=metrics)) + '\n')
+
+    for line in regressions:
+        print('regression:', line)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
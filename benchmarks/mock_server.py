@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @desc    : 本地模拟企业微信接口, 供性能测试使用, 可注入延迟及 errcode
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class Org(object):
+    """生成的通讯录: departments 个部门组成 fanout 叉树, users 个司员平均分布"""
+
+    def __init__(self, departments: int = 10, users: int = 100, fanout: int = 5):
+        self.departments: list = [{'id': 1, 'name': 'root', 'parentid': 0, 'order': 1}]
+        for id in range(2, departments + 1):
+            self.departments.append({'id': id, 'name': 'dept{}'.format(id), 'parentid': (id - 2) // fanout + 1,
+                                     'order': id})
+        self.users: list = [{'userid': 'user{}'.format(i), 'name': 'U{}'.format(i),
+                             'department': [i % departments + 1]} for i in range(users)]
+        self._children: dict = {}
+        for part in self.departments:
+            self._children.setdefault(part['parentid'], []).append(part['id'])
+        self._members: dict = {}
+        for user in self.users:
+            for id in user['department']:
+                self._members.setdefault(id, []).append(user)
+
+    def subtree(self, id: int) -> list:
+        ids, stack = [], [id]
+        while stack:
+            id = stack.pop()
+            ids.append(id)
+            stack.extend(self._children.get(id, ()))
+        return ids
+
+    def members(self, id: int, fetch_child: bool) -> list:
+        users = {}
+        for dept in (self.subtree(id) if fetch_child else [id]):
+            for user in self._members.get(dept, ()):
+                users[user['userid']] = user
+        return list(users.values())
+
+
+class MockServer(object):
+    """模拟 consts 中的接口: gettoken, department/list, user/simplelist, user/list_id,
+    message/send, media/upload, media/get, menu/create, menu/delete, 及群机器人的 webhook/send, webhook/upload_media
+
+    Examples
+    --------
+    >>> server = MockServer(latency=0.02, errors={'/cgi-bin/message/send': [(45009, 0.01)]}).start()
+    >>> client = Client('corpid', 'secret', 1, transport=Transport(base_url=server.url))
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, jitter: float = 0,
+                 errors: dict = None, http_errors: dict = None, org: Org = None, media_size: int = 1 << 20,
+                 token_ttl: int = 7200, webhook_limit: tuple = (20, 60)):
+        """
+        :param latency: 每个请求的固定延迟(秒)
+        :param jitter: 额外的随机延迟上限(秒)
+        :param errors: 注入 errcode, {endpoint: [(errcode, 比例), ...]}
+        :param http_errors: 注入 http 状态码, {endpoint: [(status, 比例), ...]}
+        :param org: 通讯录, 默认 10 个部门 100 个司员
+        :param media_size: media/get 返回的文件大小
+        :param token_ttl: access_token 的 expires_in
+        :param webhook_limit: 每个机器人 key 的频率上限 (条数, 秒), 超出时返回 45009
+        """
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.errors: dict = errors or {}
+        self.http_errors: dict = http_errors or {}
+        self.org: Org = org or Org()
+        self.media_size: int = media_size
+        self.token_ttl: int = token_ttl
+        self.stats: dict = {}
+        '''{endpoint: 请求数}'''
+        self._tokens: set = set()
+        self.webhook_limit: tuple = webhook_limit
+        self._webhooks: dict = {}
+        '''{key: 最近的发送时间}'''
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """在后台线程中启动"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def delay(self):
+        delay = self.latency + (random.random() * self.jitter if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    @staticmethod
+    def inject(table: dict, endpoint: str):
+        """按比例抽取要注入的错误, 没有时返回 None"""
+        r = random.random()
+        for code, rate in table.get(endpoint, ()):
+            if r < rate:
+                return code
+            r -= rate
+        return None
+
+    def new_token(self) -> str:
+        token = 'TOKEN{:016x}'.format(random.getrandbits(64))
+        with self._lock:
+            self._tokens.add(token)
+        return token
+
+    def valid_token(self, token: str) -> bool:
+        return token in self._tokens
+
+    def webhook_allow(self, key: str) -> bool:
+        """按滑动窗口检查机器人的频率上限"""
+        count, period = self.webhook_limit
+        now = time.monotonic()
+        with self._lock:
+            sent = self._webhooks.setdefault(key, [])
+            sent[:] = [t for t in sent if now - t < period]
+            if len(sent) >= count:
+                return False
+            sent.append(now)
+            return True
+
+
+def _handler(server: MockServer):
+    org = server.org
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 头和内容分两次写出, 不关闭 Nagle 会叠加 delayed ACK 的 40ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.dispatch(b'')
+
+        def do_POST(self):
+            self.dispatch(self.read_body())
+
+        def read_body(self) -> bytes:
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b''.join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def reply(self, result: dict, status: int = 200):
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def dispatch(self, body: bytes):
+            url = urlparse(self.path)
+            endpoint = url.path
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            server.count(endpoint)
+            server.delay()
+
+            status = server.inject(server.http_errors, endpoint)
+            if status is not None:
+                return self.reply({'errcode': -1, 'errmsg': 'http error'}, status)
+            if endpoint == '/cgi-bin/gettoken':
+                return self.reply({'errcode': 0, 'errmsg': 'ok', 'access_token': server.new_token(),
+                                   'expires_in': server.token_ttl})
+            if not endpoint.startswith('/cgi-bin/webhook/') and not server.valid_token(query.get('access_token')):
+                return self.reply({'errcode': 40014, 'errmsg': 'invalid access_token'})
+            errcode = server.inject(server.errors, endpoint)
+            if errcode is not None:
+                return self.reply({'errcode': errcode, 'errmsg': 'injected error'})
+
+            handler = getattr(self, 'on_' + endpoint.rsplit('/', 2)[-2] + '_' + endpoint.rsplit('/', 1)[-1], None)
+            if handler is None:
+                return self.reply({'errcode': 404, 'errmsg': 'unknown endpoint'}, 404)
+            return handler(query, body)
+
+        def on_department_list(self, query, body):
+            parts = org.departments
+            if 'id' in query:
+                ids = set(org.subtree(int(query['id'])))
+                parts = [part for part in parts if part['id'] in ids]
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'department': parts})
+
+        def on_user_simplelist(self, query, body):
+            users = org.members(int(query.get('department_id', 1)), query.get('fetch_child') == '1')
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'userlist': users})
+
+        def on_user_list_id(self, query, body):
+            params = json.loads(body or b'{}')
+            start, limit = int(params.get('cursor') or 0), int(params.get('limit') or 1000)
+            rows = [{'userid': user['userid'], 'department': id}
+                    for user in org.users[start:start + limit] for id in user['department']]
+            end = start + limit
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'next_cursor': str(end) if end < len(org.users) else '',
+                        'dept_user': rows})
+
+        def on_message_send(self, query, body):
+            params = json.loads(body)
+            invalid = [id for id in str(params.get('touser', '')).split('|') if id.startswith('invalid')]
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'invaliduser': '|'.join(invalid), 'invalidparty': '',
+                        'invalidtag': ''})
+
+        def on_media_upload(self, query, body):
+            media_id = 'MEDIA' + hashlib.md5(body).hexdigest()
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'type': query.get('type'), 'media_id': media_id,
+                        'created_at': str(int(time.time()))})
+
+        def on_media_get(self, query, body):
+            start = 0
+            status = 200
+            if self.headers.get('Range'):
+                start = int(self.headers['Range'].split('=')[1].split('-')[0])
+                status = 206
+            size = max(server.media_size - start, 0)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', 'attachment; filename="{}.bin"'.format(query.get('media_id')))
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            chunk = b'\0' * (1 << 16)
+            while size > 0:
+                n = min(size, len(chunk))
+                self.wfile.write(chunk[:n])
+                size -= n
+
+        def on_webhook_send(self, query, body):
+            params = json.loads(body)
+            if params.get('msgtype') not in params:
+                return self.reply({'errcode': 40008, 'errmsg': 'invalid message type'})
+            if not server.webhook_allow(query.get('key')):
+                return self.reply({'errcode': 45009, 'errmsg': 'api freq out of limit'})
+            self.reply({'errcode': 0, 'errmsg': 'ok'})
+
+        def on_webhook_upload_media(self, query, body):
+            media_id = 'MEDIA' + hashlib.md5(query.get('key', '').encode('utf-8') + body).hexdigest()
+            self.reply({'errcode': 0, 'errmsg': 'ok', 'type': query.get('type'), 'media_id': media_id,
+                        'created_at': str(int(time.time()))})
+
+        def on_menu_create(self, query, body):
+            self.reply({'errcode': 0, 'errmsg': 'ok'})
+
+        def on_menu_delete(self, query, body):
+            self.reply({'errcode': 0, 'errmsg': 'ok'})
+
+    return Handler
+
+
+def parse_errors(items: list) -> dict:
+    """['/cgi-bin/message/send:45009:0.01', ...] -> {endpoint: [(code, rate)]}"""
+    table = {}
+    for item in items or ():
+        endpoint, code, rate = item.rsplit(':', 2)
+        table.setdefault(endpoint, []).append((int(code), float(rate)))
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地模拟企业微信接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0, help='额外的随机延迟上限(秒)')
+    parser.add_argument('--departments', type=int, default=10)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--error', action='append', help='注入 errcode, endpoint:errcode:比例, 可多次指定')
+    parser.add_argument('--http-error', action='append', help='注入 http 状态码, endpoint:status:比例')
+    parser.add_argument('--media-size', type=int, default=1 << 20)
+    args = parser.parse_args(argv)
+
+    server = MockServer(args.host, args.port, args.latency, args.jitter, parse_errors(args.error),
+                        parse_errors(args.http_error), Org(args.departments, args.users), args.media_size)
+    # 第一行输出地址, 供 bench.py 读取
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,10 @@ setup(
     # packages=find_packages(),
     packages=['work_weixin'],
     install_requires=read_requirements('requirements.txt'),  # 指定需要安装的依赖
+    extras_require={'async': ['aiohttp>=3.6'],  # 可选依赖: AsyncClient
+                    'callback': ['aiohttp>=3.6', 'cryptography'],  # 可选依赖: CallbackServer
+                    'fast': ['orjson']},  # 可选依赖: 更快的 json 序列化
+    entry_points={'console_scripts': ['work_weixin=work_weixin.cli:main']},  # 命令行批量发送
     include_package_data=True,
     license="MIT License",
     platforms="any",
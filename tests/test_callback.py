@@ -0,0 +1,44 @@
+import asyncio
+import time
+import unittest
+
+from work_weixin.callback import CallbackServer
+
+TOKEN = 'QDG6eK'
+ENCODING_AES_KEY = 'jWmYm7qr5nMoAUwZRjGtBxmz3KA1tkAj3ykkR6q2B2C'
+CORPID = 'wx5823bf96d3bd56c7'
+NONCE = '263014780'
+
+
+class TestCallbackServer(unittest.TestCase):
+
+    def test_failing_handler_does_not_stop_others(self):
+        server = CallbackServer(TOKEN, ENCODING_AES_KEY, CORPID, workers=1)
+        received = []
+
+        @server.on(msg_type='text')
+        def broken(msg):
+            raise RuntimeError('boom')
+
+        @server.on(msg_type='text')
+        async def record(msg):
+            received.append(msg['Content'])
+
+        async def run():
+            timestamp = str(int(time.time()))
+            body = server.crypt.encrypt_msg('<xml><MsgType>text</MsgType><Content>hi</Content></xml>', NONCE, timestamp)
+            encrypt = body.split('<Encrypt><![CDATA[')[1].split(']]>')[0]
+            query = {'msg_signature': server.crypt.signature(timestamp, NONCE, encrypt), 'timestamp': timestamp,
+                     'nonce': NONCE}
+            with self.assertLogs('work_weixin.callback', 'ERROR'):
+                self.assertEqual(await server.handle('POST', query, body.encode('utf-8')), (200, ''))
+                await server.stop()
+
+        asyncio.run(run())
+        self.assertEqual(received, ['hi'])
+        self.assertEqual(server.stats['errors'], 1)
+        self.assertEqual(server.stats['handled'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockServer  # noqa: E402
+from work_weixin import Client, MemoryTokenStore, consts as c  # noqa: E402
+from work_weixin.cli import BatchSender, Checkpoint  # noqa: E402
+from work_weixin.transport import Transport  # noqa: E402
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.dir, 'result.jsonl')
+        self.path = self.log_path + '.checkpoint'
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_load_reads_log_after_offset(self):
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            for row in range(3):
+                f.write(json.dumps({'row': row}) + '\n')
+            offset = f.tell()
+            # 检查点之后乱序完成的行, 及中断时写了一半的行
+            for row in (5, 3, 4, 8):
+                f.write(json.dumps({'row': row}) + '\n')
+            f.write('{"row": 9')
+        checkpoint = Checkpoint(self.path, self.log_path)
+        checkpoint.done = 3
+        checkpoint.save(offset)
+
+        checkpoint = Checkpoint(self.path, self.log_path).load()
+        self.assertEqual(checkpoint.done, 6)
+        self.assertEqual([row for row in range(10) if checkpoint.is_done(row)], [0, 1, 2, 3, 4, 5, 8])
+
+
+class TestBatchSender(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer().start()
+        self.client = Client('corpid', 'secret', 1, transport=Transport(base_url=self.server.url),
+                             token_store=MemoryTokenStore(), load_directory=False)
+        self.dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.dir, 'result.jsonl')
+        self.checkpoint_path = self.log_path + '.checkpoint'
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def sender(self) -> BatchSender:
+        return BatchSender(self.client, self.log_path, self.checkpoint_path, concurrency=4,
+                           template='{name}, 你的工资条已发放')
+
+    def test_resume_skips_completed_rows(self):
+        rows = [{'touser': 'user{}'.format(i), 'name': 'U{}'.format(i)} for i in range(20)]
+        # 第一次运行在第 12 行中断
+        self.assertEqual(self.sender().run(iter(rows[:12])), {'sent': 12, 'failed': 0, 'skipped': 0})
+
+        stats = self.sender().run(iter(rows))
+        self.assertEqual(stats, {'sent': 8, 'failed': 0, 'skipped': 12})
+        self.assertEqual(self.server.stats[c.SEND_MSG], 20)
+        with open(self.log_path, encoding='utf-8') as f:
+            self.assertEqual(sorted(json.loads(line)['row'] for line in f), list(range(20)))
+
+
+if __name__ == '__main__':
+    unittest.main()
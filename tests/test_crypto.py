@@ -0,0 +1,57 @@
+import base64
+import socket
+import struct
+import time
+import unittest
+
+from work_weixin import exceptions
+from work_weixin.crypto import WXBizMsgCrypt
+
+# 企业微信官方文档中验证回调URL的示例
+TOKEN = 'QDG6eK'
+ENCODING_AES_KEY = 'jWmYm7qr5nMoAUwZRjGtBxmz3KA1tkAj3ykkR6q2B2C'
+RECEIVE_ID = 'wx5823bf96d3bd56c7'
+MSG_SIGNATURE = '5c45ff5e21c57e6ad56bac8758b79b1d9ac89fd3'
+TIMESTAMP = '1409659589'
+NONCE = '263014780'
+ECHOSTR = 'P9nAzCzyDtyTWESHep1vC5X9xho/qYX3Zpb4yKa9SKld1DsH3Iyt3tP3zNdtp+4RPcs8TgAE7OaBO+FZXvnaqQ=='
+
+
+class TestWXBizMsgCrypt(unittest.TestCase):
+
+    def test_verify_url_official_vector(self):
+        crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, RECEIVE_ID, max_age=None)
+        self.assertEqual(crypt.verify_url(MSG_SIGNATURE, TIMESTAMP, NONCE, ECHOSTR), '1616140317555161061')
+
+    def test_signature_mismatch(self):
+        crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, RECEIVE_ID, max_age=None)
+        with self.assertRaises(exceptions.WorkCallbackException):
+            crypt.verify_url('0' * 40, TIMESTAMP, NONCE, ECHOSTR)
+
+    def test_expired_timestamp(self):
+        crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, RECEIVE_ID)
+        with self.assertRaises(exceptions.WorkCallbackException):
+            crypt.verify_url(MSG_SIGNATURE, TIMESTAMP, NONCE, ECHOSTR)
+
+    def test_encrypt_msg_roundtrip(self):
+        crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, RECEIVE_ID)
+        timestamp = str(int(time.time()))
+        reply = crypt.encrypt_msg('<xml><Content>你好</Content></xml>', NONCE, timestamp)
+        encrypt = reply.split('<Encrypt><![CDATA[')[1].split(']]>')[0]
+        signature = crypt.signature(timestamp, NONCE, encrypt)
+        self.assertEqual(crypt.decrypt_msg(reply, signature, timestamp, NONCE), '<xml><Content>你好</Content></xml>')
+
+    def test_decrypt_invalid_utf8(self):
+        crypt = WXBizMsgCrypt(TOKEN, ENCODING_AES_KEY, RECEIVE_ID)
+        msg = b'\xff\xfe'
+        plain = b'0' * 16 + struct.pack('I', socket.htonl(len(msg))) + msg + RECEIVE_ID.encode('utf-8')
+        pad = 32 - len(plain) % 32
+        plain += bytes([pad]) * pad
+        encryptor = crypt._cipher().encryptor()
+        encrypt = base64.b64encode(encryptor.update(plain) + encryptor.finalize()).decode('ascii')
+        with self.assertRaises(exceptions.WorkCallbackException):
+            crypt.decrypt(encrypt)
+
+
+if __name__ == '__main__':
+    unittest.main()
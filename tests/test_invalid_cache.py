@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockServer  # noqa: E402
+from work_weixin import Client, Directory, InvalidRecipientCache, MemoryTokenStore, consts as c  # noqa: E402
+from work_weixin.transport import Transport  # noqa: E402
+
+
+class TestInvalidRecipientCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+
+    def client(self, cache: InvalidRecipientCache, agentid=1) -> Client:
+        client = Client('corpid', 'secret{}'.format(agentid), agentid, transport=Transport(base_url=self.server.url),
+                        token_store=MemoryTokenStore(), load_directory=False, invalid_cache=cache)
+        self.clients.append(client)
+        return client
+
+    def sent(self) -> int:
+        return self.server.stats.get(c.SEND_MSG, 0)
+
+    def test_invalid_recipients_skipped(self):
+        cache = InvalidRecipientCache()
+        client = self.client(cache)
+        self.assertEqual(client.send_text_touser('user1|invalid1', 'hi')['invaliduser'], 'invalid1')
+        self.assertEqual(len(cache), 1)
+
+        # 去掉已知无效的接收人, 返回结果中仍列出
+        self.assertEqual(client.send_text_touser('INVALID1|user2', 'hi')['invaliduser'], 'INVALID1')
+        self.assertEqual(self.sent(), 2)
+        # 接收人均无效时不再请求
+        result = client.send_text_touser('invalid1', 'hi')
+        self.assertEqual((result['errcode'], result['invaliduser']), (0, 'invalid1'))
+        self.assertEqual(self.sent(), 2)
+        self.assertEqual(cache.stats['hits'], 2)
+        self.assertEqual(cache.stats['skipped_requests'], 1)
+
+    def test_scopes_are_separate(self):
+        cache = InvalidRecipientCache()
+        self.client(cache, agentid=1).send_text_touser('invalid1', 'hi')
+        # 另一个应用的可见范围不同, 照常发送
+        self.client(cache, agentid=2).send_text_touser('invalid1', 'hi')
+        self.assertEqual(self.sent(), 2)
+
+    def test_expired_entries_sent_again(self):
+        cache = InvalidRecipientCache(ttl=0.1)
+        client = self.client(cache)
+        client.send_text_touser('invalid1', 'hi')
+        time.sleep(0.15)
+        client.send_text_touser('invalid1', 'hi')
+        self.assertEqual(self.sent(), 2)
+
+    def test_revalidate_only_loading_scope(self):
+        cache = InvalidRecipientCache()
+        cache.add(user='User1', party='3', scope=('corpid', '1'))
+        cache.add(user='user1', scope=('corpid', '2'))
+        directory = Directory([{'id': 3, 'name': 'dept3', 'parentid': 1}], [{'userid': 'user1', 'name': 'U1'}])
+        cache.revalidate(directory, ('corpid', '1'))
+        self.assertEqual(len(cache), 1)
+        self.assertIn((('corpid', '2'), 'user', 'user1'), cache)
+
+    def test_directory_reload_revalidates(self):
+        cache = InvalidRecipientCache()
+        client = self.client(cache)
+        cache.add(user='user1|gone', scope=('corpid', '1'))
+        client.directory_cache.reload()
+        self.assertNotIn((('corpid', '1'), 'user', 'user1'), cache)
+        self.assertIn((('corpid', '1'), 'user', 'gone'), cache)
+
+    def test_max_entries(self):
+        cache = InvalidRecipientCache(max_entries=3)
+        for i in range(5):
+            cache.add(user='user{}'.format(i))
+        self.assertEqual(len(cache), 3)
+        self.assertIn((None, 'user', 'user4'), cache)
+        self.assertNotIn((None, 'user', 'user0'), cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockServer  # noqa: E402
+from work_weixin import Client, MemoryTokenStore, RetryPolicy, CircuitBreaker, consts as c, exceptions  # noqa: E402
+from work_weixin.transport import Transport  # noqa: E402
+
+
+class _ClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+
+    def client(self, **kwargs) -> Client:
+        client = Client('corpid', 'secret', 1, transport=Transport(base_url=self.server.url),
+                        token_store=MemoryTokenStore(), load_directory=False, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def count(self, endpoint: str) -> int:
+        return self.server.stats.get(endpoint, 0)
+
+
+class TestRetryPolicy(_ClientTestCase):
+
+    def test_transient_error_retried_until_max_attempts(self):
+        self.server.errors = {c.GET_DEPARTMENT: [(-1, 1.0)]}
+        client = self.client(retry_policy=RetryPolicy(max_attempts=3, backoff=0.01))
+        with self.assertRaises(exceptions.WorkException) as cm:
+            list(client.iter_departments())
+        self.assertEqual(cm.exception.code, -1)
+        self.assertEqual(self.count(c.GET_DEPARTMENT), 3)
+
+    def test_business_error_not_retried(self):
+        self.server.errors = {c.GET_DEPARTMENT: [(60011, 1.0)]}
+        client = self.client(retry_policy=RetryPolicy(max_attempts=3, backoff=0.01))
+        with self.assertRaises(exceptions.WorkException):
+            list(client.iter_departments())
+        self.assertEqual(self.count(c.GET_DEPARTMENT), 1)
+
+    def test_expired_token_refreshed_and_replayed(self):
+        client = self.client()
+        self.server._tokens.clear()
+        self.assertEqual(len(list(client.iter_departments())), 10)
+        self.assertEqual(self.count(c.GET_ACCESS_TOKEN), 2)
+        self.assertEqual(self.count(c.GET_DEPARTMENT), 2)
+
+
+class TestCircuitBreaker(_ClientTestCase):
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        client = self.client(retry_policy=RetryPolicy.disabled(), circuit_breaker=breaker)
+        self.server.http_errors = {c.GET_DEPARTMENT: [(503, 1.0)]}
+
+        def call():
+            return list(client.iter_departments())
+
+        for _ in range(2):
+            self.assertRaises(exceptions.WorkException, call)
+        self.assertEqual(breaker.state(c.GET_DEPARTMENT), CircuitBreaker.OPEN)
+        # 熔断期间不请求接口
+        self.assertRaises(exceptions.WorkCircuitOpenException, call)
+        self.assertEqual(self.count(c.GET_DEPARTMENT), 2)
+
+        # 探测失败: 再熔断
+        time.sleep(0.25)
+        self.assertRaises(exceptions.WorkException, call)
+        self.assertEqual(self.count(c.GET_DEPARTMENT), 3)
+        self.assertEqual(breaker.state(c.GET_DEPARTMENT), CircuitBreaker.OPEN)
+        self.assertRaises(exceptions.WorkCircuitOpenException, call)
+
+        # 探测成功: 恢复
+        self.server.http_errors = {}
+        time.sleep(0.25)
+        self.assertEqual(len(call()), 10)
+        self.assertEqual(breaker.state(c.GET_DEPARTMENT), CircuitBreaker.CLOSED)
+        self.assertEqual(len(call()), 10)
+
+    def test_business_error_does_not_open(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        client = self.client(retry_policy=RetryPolicy.disabled(), circuit_breaker=breaker)
+        self.server.errors = {c.GET_DEPARTMENT: [(60011, 1.0)]}
+        for _ in range(3):
+            self.assertRaises(exceptions.WorkException, lambda: list(client.iter_departments()))
+        self.assertEqual(breaker.state(c.GET_DEPARTMENT), CircuitBreaker.CLOSED)
+
+    def test_released_probe_lets_next_request_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+        breaker.record(c.SEND_MSG, exceptions.WorkRequestException('timeout'))
+        self.assertRaises(exceptions.WorkCircuitOpenException, breaker.before, c.SEND_MSG)
+        time.sleep(0.25)
+        breaker.before(c.SEND_MSG)
+        self.assertEqual(breaker.state(c.SEND_MSG), CircuitBreaker.HALF_OPEN)
+        # 探测请求被取消, 没有结果: 下一个请求立即再探测, 而不是等到 reset_timeout
+        breaker.release(c.SEND_MSG)
+        breaker.before(c.SEND_MSG)
+        self.assertEqual(breaker.state(c.SEND_MSG), CircuitBreaker.HALF_OPEN)
+        self.assertRaises(exceptions.WorkCircuitOpenException, breaker.before, c.SEND_MSG)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from mock_server import MockServer  # noqa: E402
+from work_weixin import Client, MemoryTokenStore, RetryPolicy, consts as c  # noqa: E402
+from work_weixin.spool import MessageQueue, PRIORITY_HIGH, PRIORITY_LOW  # noqa: E402
+from work_weixin.transport import Transport  # noqa: E402
+
+
+class _FailNth(dict):
+    """注入错误的表: 第 n 次(从 1 开始)请求 endpoint 时返回 errcode"""
+
+    def __init__(self, endpoint: str, n: int, errcode: int):
+        super().__init__()
+        self.endpoint, self.n, self.errcode, self.calls = endpoint, n, errcode, 0
+
+    def get(self, endpoint, default=None):
+        if endpoint != self.endpoint:
+            return default
+        self.calls += 1
+        return [(self.errcode, 1.0)] if self.calls == self.n else []
+
+
+class TestMessageQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer().start()
+        # 每个用例一个 token 存储, 不使用上一个 MockServer 签发的 token
+        self.client = Client('corpid', 'secret', 1, transport=Transport(base_url=self.server.url),
+                             token_store=MemoryTokenStore(), load_directory=False, send_workers=1,
+                             retry_policy=RetryPolicy.disabled())
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'spool.db')
+        self.results = []
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def on_result(self, id, message, result):
+        self.results.append((id, message, result))
+
+    def sent(self) -> int:
+        return self.server.stats.get(c.SEND_MSG, 0)
+
+    def test_high_priority_sent_before_backlog(self):
+        queue = MessageQueue(self.client, self.path, workers=1, on_result=self.on_result)
+        low = [queue.put(touser='user1', content={'content': 'low'}, priority=PRIORITY_LOW) for _ in range(3)]
+        high = queue.put(touser='user2', content={'content': 'high'}, priority=PRIORITY_HIGH)
+        with queue:
+            self.assertTrue(queue.join(10))
+        self.assertEqual([id for id, _, _ in self.results], [high] + low)
+
+    def test_inflight_message_resent_after_lease(self):
+        crashed = MessageQueue(self.client, self.path, lease=0.5)
+        id = crashed.put(touser='user1', content={'content': 'hello'})
+        # 发送前进程崩溃: 消息停留在发送中
+        self.assertEqual(crashed._claim()[0], id)
+
+        # 多进程共用队列时不立即接管, lease 超时后重新发送
+        queue = MessageQueue(self.client, self.path, lease=0.5, poll_interval=0.05, on_result=self.on_result)
+        queue.start(recover=False)
+        try:
+            time.sleep(0.2)
+            self.assertEqual(self.sent(), 0)
+            self.assertTrue(queue.join(10))
+        finally:
+            queue.stop()
+        self.assertEqual(self.sent(), 1)
+        self.assertEqual(self.results[0][0], id)
+
+    def test_inflight_message_recovered_on_start(self):
+        crashed = MessageQueue(self.client, self.path, lease=60)
+        crashed.put(touser='user1', content={'content': 'hello'})
+        crashed._claim()
+        with MessageQueue(self.client, self.path, lease=60, poll_interval=0.05) as queue:
+            self.assertTrue(queue.join(5))
+        self.assertEqual(self.sent(), 1)
+
+    def test_partial_batch_rescheduled(self):
+        # 1500 个接收人分为 1000 + 500 两批, 第二批失败
+        self.server.errors = _FailNth(c.SEND_MSG, 2, 60020)
+        users = ['user{}'.format(i) for i in range(1500)]
+        queue = MessageQueue(self.client, self.path, retry_delay=0, poll_interval=0.05, on_result=self.on_result)
+        queue.put(touser='|'.join(users), content={'content': 'hello'})
+        with queue:
+            self.assertTrue(queue.join(10))
+        self.assertEqual(self.sent(), 3)
+        (_, first, result), (_, retried, _) = self.results
+        self.assertEqual(result['errcode'], 60020)
+        self.assertEqual(first['touser'].split('|'), users)
+        # 只重发失败的批次
+        self.assertEqual(retried['touser'].split('|'), users[1000:])
+
+    def test_dead_after_max_attempts(self):
+        self.server.errors = {c.SEND_MSG: [(60020, 1.0)]}
+        queue = MessageQueue(self.client, self.path, max_attempts=2, retry_delay=0, poll_interval=0.05)
+        id = queue.put(touser='user1', content={'content': 'hello'})
+        with queue:
+            self.assertTrue(queue.join(10))
+        self.assertEqual(self.sent(), 2)
+        self.assertEqual([dead[0] for dead in queue.dead()], [id])
+        self.assertEqual(queue.requeue_dead(), 1)
+        self.assertEqual(queue.pending(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,4 +6,20 @@
 # @desc    :
 
 from .client import Client
+from .token import MemoryTokenStore, FileTokenStore, SQLiteTokenStore
+from .directory import Directory
+from .snapshot import DirectorySnapshot
+from .ratelimit import RateLimiter
+from .spool import MessageQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from .coalesce import Coalescer
+from .media_cache import MediaCache
+from .manager import ClientManager
+from .metrics import Metrics
+from .template import MessageTemplate, ContentTemplate
+from .retry import RetryPolicy, CircuitBreaker
+from .invalid_cache import InvalidRecipientCache
+from .webhook import WebhookSender
+from .log_handler import WorkWeixinHandler, DROP_NEW, DROP_OLD, BLOCK
 
+from .aio import AsyncClient
+from .callback import CallbackServer, CallbackSimulator
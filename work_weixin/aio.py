@@ -0,0 +1,399 @@
+import asyncio
+import os
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from . import consts as c, utils, exceptions
+from .client import BaseClient
+from .token import AsyncTokenManager, TokenStore, token_key
+from .ratelimit import RateLimiter
+from .media_cache import MediaCache
+from .directory import Directory
+from .metrics import Metrics, body_size
+from .serializer import default_serializer
+from .retry import RetryPolicy, CircuitBreaker
+from .template import ContentTemplate
+from .invalid_cache import InvalidRecipientCache
+
+
+class AsyncClient(BaseClient):
+    """基于 asyncio/aiohttp 的非阻塞客户端, 接口与 Client 一致
+
+    Examples
+    --------
+    >>> async with AsyncClient(corpid, secret, agentid) as client:
+    ...     await asyncio.gather(*[client.send_text_touser(u, 'hello') for u in users])
+    """
+
+    def __init__(self, corpid: str = 'corpid', secret: str = 'secret', agentid='agentid', session=None,
+                 pool_size: int = 100, timeout: tuple = (3.05, 10), deadline: float = None,
+                 base_url: str = c.API_URL, send_workers: int = 8, rate_limiter: RateLimiter = None,
+                 media_cache: MediaCache = None, metrics: Metrics = None, serializer=None,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None,
+                 invalid_cache: InvalidRecipientCache = None, token_store: TokenStore = None):
+        """
+        初始化接口, 不发送请求; 需 await open() 或使用 async with
+
+        :param corpid: 企业ID
+        :param secret: 安全码
+        :param agentid: 部门ID
+        :param session: 共用的 aiohttp.ClientSession, 为 None 时按后面的参数新建
+        :param pool_size: 连接池大小(同时在途的请求数)
+        :param timeout: (连接超时, 读取超时) 秒
+        :param deadline: 单次调用的总时限(秒)
+        :param base_url: 接口地址
+        :param send_workers: 接收人超过接口上限分批发送时的并发数
+        :param rate_limiter: 按接口及接收人限流, 超出时等待(按 corpid, agentid 分别计算, 可共用); None 为不限流
+        :param media_cache: 按文件内容缓存 media_id, 同样的文件在有效期内不再重复上传(按 corpid 分别缓存, 可共用)
+        :param metrics: 按接口统计耗时、errcode 等, 可与 Client 共用; None 为不统计
+        :param serializer: 请求及返回的 json 序列化, 默认安装了 orjson 时用 orjson, 否则用标准库
+        :param retry_policy: token 失效时刷新并重放, 接口繁忙时退避重试; 默认 RetryPolicy(), 不重试用 RetryPolicy.disabled()
+        :param circuit_breaker: 按接口熔断, 可与 Client 共用; None 为不熔断
+        :param invalid_cache: 无效接收人的缓存, 可与 Client 共用, load_directory 后移除重新出现的司员及部门; None 为不缓存
+        :param token_store: token 存储, 可与 Client 共用(如 FileTokenStore 在多个进程间共用), 默认为进程内共用的内存存储
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncClient requires aiohttp: pip install aiohttp')
+
+        self.corp_id: str = corpid
+        self.secret: str = secret
+        self.agent_id: str = agentid
+        self.send_workers: int = send_workers
+        self.rate_limiter: RateLimiter = rate_limiter
+        self.media_cache: MediaCache = media_cache
+        self.metrics: Metrics = metrics
+        self.serializer = serializer or default_serializer()
+        self._templates: dict = {}
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy()
+        self.circuit_breaker: CircuitBreaker = circuit_breaker
+        self.invalid_cache: InvalidRecipientCache = invalid_cache
+        # token 按 expires_in 缓存并提前刷新, 同 Client
+        self.tokens: AsyncTokenManager = AsyncTokenManager(self._fetch_token, token_key(corpid, secret), token_store)
+        self.base_url: str = base_url
+        self.pool_size: int = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=deadline, sock_connect=timeout[0], sock_read=timeout[1])
+        self.session = session
+        self._own_session: bool = session is None
+
+        self.directory: Directory = Directory()
+        '''部门及司员(带索引), 由 load_directory 加载'''
+
+    async def open(self):
+        """建立连接池并获取 token"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        await self.tokens.get()
+        return self
+
+    @property
+    def access_token(self) -> str:
+        """当前缓存的 token, 不发送请求"""
+        return self.tokens._token
+
+    async def _fetch_token(self):
+        """请求 gettoken
+
+        :return: (access_token, expires_in)
+        """
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(c.GET_ACCESS_TOKEN, corpid=self.corp_id)
+        path = c.GET_ACCESS_TOKEN + utils.parse_params_to_str({'corpid': self.corp_id, 'corpsecret': self.secret})
+        if self.metrics is None:
+            result = await self._http(c.GET, path, {}, None)
+        else:
+            with self.metrics.track(c.GET_ACCESS_TOKEN, c.GET) as info:
+                result = await self._http(c.GET, path, {}, None, info)
+        return result['access_token'], result.get('expires_in', 7200)
+
+    async def close(self):
+        """关闭连接池(外部传入的 session 由调用方关闭)"""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def load_directory(self, concurrency: int = 10):
+        """加载部门及司员信息, 同 Client.load_directory
+
+        :param concurrency: 同时请求的子树数
+        """
+        departments = await self._get_departments()
+        children: dict = {}
+        for part in departments.values():
+            children.setdefault(part.get('parentid'), []).append(part['id'])
+        roots = [id for id, part in departments.items() if part.get('parentid') not in departments]
+        semaphore = asyncio.Semaphore(concurrency)
+        users: dict = {}
+
+        async def get_subtree(id, fetch_child=1):
+            try:
+                async with semaphore:
+                    users.update(await self._get_users(id, fetch_child))
+            except (exceptions.WorkException, exceptions.WorkRequestException):
+                if fetch_child == 0 or id not in children:
+                    raise
+                # 拆分子树: 本部门的直属司员 + 各子部门的子树
+                await asyncio.gather(get_subtree(id, 0), *[get_subtree(child) for child in children[id]])
+
+        await asyncio.gather(*[get_subtree(id) for id in roots])
+        self.directory = Directory(departments, users)
+        if self.invalid_cache is not None:
+            self.invalid_cache.revalidate(self.directory, (self.corp_id, str(self.agent_id)))
+
+    @property
+    def departments(self) -> dict:
+        """部门结构 {id: department}, 首次访问时由索引生成 dict; 查询子树、成员用 directory"""
+        return self.directory.departments
+
+    @property
+    def users(self) -> dict:
+        """司员信息 {userid: user}, 首次访问时由索引生成 dict; 按姓名、部门查询用 directory"""
+        return self.directory.users
+
+    async def _get_departments(self) -> dict:
+        """获取组织结构, 同 Client._get_departments"""
+        result = await self._request(c.GET, c.GET_DEPARTMENT)
+        return {part['id']: part for part in result['department']}
+
+    async def _get_users(self, department_id: int = 0, fetch_child: int = 0) -> dict:
+        """获取司员信息, 同 Client._get_users"""
+        result = await self._request(c.GET, c.GET_USER_LIST, {'department_id': department_id, 'fetch_child': fetch_child})
+        return {user['userid']: user for user in result['userlist']}
+
+    async def iter_departments(self, department_id: int = None):
+        """逐个返回部门, 同 Client.iter_departments"""
+        params = {} if department_id is None else {'id': department_id}
+        result = await self._request(c.GET, c.GET_DEPARTMENT, params)
+        for part in result['department']:
+            yield part
+
+    async def iter_users(self, page_size: int = 1000):
+        """按游标分页逐个返回司员, 同 Client.iter_users; 处理当前页时已在请求下一页"""
+        def fetch(cursor):
+            return asyncio.ensure_future(self._request(c.POST, c.GET_USER_LIST_ID, {'cursor': cursor, 'limit': page_size}))
+
+        task = fetch('')
+        try:
+            while task is not None:
+                result = await task
+                cursor = result.get('next_cursor', '')
+                task = fetch(cursor) if cursor else None
+                for row in result.get('dept_user', []):
+                    yield row
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def send_text_touser(self, touser: str, msg: str):
+        """发送消息给同事, 同 Client.send_text_touser"""
+        return await self.send_msg(touser=touser, msgtype='text', content={'content': msg})
+
+    async def send_text_toparty(self, toparty: str, msg: str):
+        """发送消息给部门, 同 Client.send_text_toparty"""
+        return await self.send_msg(toparty=toparty, msgtype='text', content={'content': msg})
+
+    async def send_text_totag(self, totag: str, msg: str):
+        """发送消息给标签, 同 Client.send_text_totag"""
+        return await self.send_msg(totag=totag, msgtype='text', content={'content': msg})
+
+    async def send_img(self, touser: str = '', toparty: str = '', totag: str = '', media_id='',
+                       img_file: str = None) -> dict:
+        """发送图片消息, 同 Client.send_img"""
+        if img_file is not None:
+            media_id = (await self.upload_tmp(img_file))['media_id']
+        return await self.send_msg(touser, toparty, totag, msgtype='image', content={'media_id': media_id})
+
+    async def send_file(self, touser: str = '', toparty: str = '', totag: str = '', media_id='',
+                        file_name: str = None) -> dict:
+        """发送文件消息, 同 Client.send_file"""
+        if file_name is not None:
+            media_id = (await self.upload_tmp(file_name))['media_id']
+        return await self.send_msg(touser, toparty, totag, msgtype='file', content={'media_id': media_id})
+
+    async def send_msg(self, touser: str = '', toparty: str = '', totag: str = '', msgtype: str = 'text',
+                       content: dict = {}) -> dict:
+        """发送消息, 参数及返回值同 Client.send_msg"""
+        touser, toparty, totag, skipped = self._filter_invalid(touser, toparty, totag)
+        if skipped and not (touser or toparty or totag):
+            return self._add_skipped({'errcode': 0, 'errmsg': 'ok'}, skipped)
+
+        batches = self._split_recipients(touser, toparty, totag)
+        if len(batches) == 1:
+            return self._add_skipped(await self._send_batch(batches[0], msgtype, content), skipped)
+
+        # 各批内容相同, 只编码一次
+        content = self._msg_template(msgtype).encode_content(content)
+        semaphore = asyncio.Semaphore(self.send_workers)
+
+        async def send(batch):
+            async with semaphore:
+                return await self._send_batch(batch, msgtype, content)
+
+        results = await asyncio.gather(*[send(batch) for batch in batches], return_exceptions=True)
+        errors = [r for r in results if isinstance(r, (exceptions.WorkException, exceptions.WorkRequestException))]
+        for r in results:
+            if isinstance(r, BaseException) and r not in errors:
+                raise r
+        if len(errors) == len(batches):
+            raise errors[0]
+        merged = self._merge_results(batches, [self._error_result(r) if isinstance(r, Exception) else r for r in results])
+        return self._add_skipped(merged, skipped)
+
+    async def send_bulk(self, template: ContentTemplate, recipients, common: dict = None) -> dict:
+        """按接收人渲染模板后发送, 渲染结果相同的接收人合并为一次 send_msg; 参数及返回值同 Client.send_bulk"""
+        groups = list(template.group(recipients, common).items())
+        if not groups:
+            return self._merge_bulk([], [])
+        semaphore = asyncio.Semaphore(self.send_workers)
+
+        async def send(group):
+            async with semaphore:
+                return await self.send_msg(touser=group[1], msgtype=template.msgtype, content=group[0])
+
+        results = await asyncio.gather(*[send(group) for group in groups], return_exceptions=True)
+        errors = [r for r in results if isinstance(r, (exceptions.WorkException, exceptions.WorkRequestException))]
+        for r in results:
+            if isinstance(r, BaseException) and r not in errors:
+                raise r
+        if len(errors) == len(groups):
+            raise errors[0]
+        return self._merge_bulk(groups, [self._error_result(r) if isinstance(r, Exception) else r for r in results])
+
+    async def _send_batch(self, batch: tuple, msgtype: str, content: dict) -> dict:
+        """发送一批(不超过接口上限的)接收人"""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(recipients=self._recipient_keys(batch), corpid=self.corp_id,
+                                                  agentid=self.agent_id)
+        data = self._msg_template(msgtype).render(*batch, content)
+        if self.invalid_cache is None:
+            return await self._request(c.POST, c.SEND_MSG, data=data)
+        try:
+            result = await self._request(c.POST, c.SEND_MSG, data=data)
+        except exceptions.WorkException as e:
+            self._record_invalid(batch, error=e)
+            raise
+        self._record_invalid(batch, result)
+        return result
+
+    async def upload_tmp(self, file_name: str, fileobj=None) -> dict:
+        """上传临时素材, 同 Client.upload_tmp; 文件内容分块流式上传
+
+        :param fileobj: 文件对象或字节块的迭代器, 代替读取 file_name
+        """
+        type, content_type = self._media_type(file_name)
+        if fileobj is not None:
+            if not hasattr(fileobj, 'read'):
+                fileobj = await asyncio.get_running_loop().run_in_executor(None, utils.spool_iterable, fileobj)
+            return await self._upload(file_name, fileobj, type, content_type)
+        if self.media_cache is None:
+            with open(file_name, 'rb') as f:
+                return await self._upload(file_name, f, type, content_type)
+
+        digest = await asyncio.get_running_loop().run_in_executor(None, self.media_cache.digest, file_name)
+        item = self.media_cache.get(digest, type, self.corp_id)
+        if item is not None:
+            return {'errcode': 0, 'errmsg': 'ok', 'type': type, **item}
+        with open(file_name, 'rb') as f:
+            result = await self._upload(file_name, f, type, content_type)
+        self.media_cache.put(digest, type, result['media_id'], result.get('created_at'), self.corp_id)
+        return result
+
+    async def _upload(self, file_name: str, f, type: str, content_type: str) -> dict:
+        form = aiohttp.FormData()
+        form.add_field('name', 'media')
+        form.add_field('filename', os.path.split(file_name)[1])
+        # file中的第一个参数应为文件名, 但不能是中文, 故此处采用type替代亦可
+        form.add_field('file', f, filename='name_no_cn', content_type=content_type)
+        return await self._request(c.POST, c.UPLOAD_TMP, params='', add_path={'type': type}, data=form)
+
+    async def _request(self, method, request_path, params: dict = {}, add_path: dict = {}, add_header: dict = {},
+                       data=None) -> dict:
+        """
+        发送请求
+
+        :param method: c.GET or c.POST
+        :param request_path: 请求路径
+        :param params: 请求参数
+        :return: result of dict
+        """
+        if self.session is None:
+            raise exceptions.WorkRequestException('AsyncClient is not opened, use "await client.open()"')
+        policy, breaker = self.retry_policy, self.circuit_breaker
+        replayable = data is None or isinstance(data, (bytes, str))
+        attempt, replayed = 0, False
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(request_path, corpid=self.corp_id)
+            if breaker is not None:
+                breaker.before(request_path)
+            token = await self.tokens.get()
+            try:
+                if self.metrics is None:
+                    result = await self._send(method, request_path, params, add_path, add_header, data)
+                else:
+                    with self.metrics.track(request_path, method) as info:
+                        result = await self._send(method, request_path, params, add_path, add_header, data, info)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # 取消、KeyboardInterrupt 等: 不计为接口失败, 但不能让探测状态一直保留
+                    if breaker is not None:
+                        breaker.release(request_path)
+                    raise
+                if breaker is not None:
+                    breaker.record(request_path, e)
+                if not replayable or not isinstance(e, (exceptions.WorkException, exceptions.WorkRequestException)):
+                    raise
+                if not replayed and policy.is_token_error(e):
+                    replayed = True
+                    await self.tokens.get(stale=token)
+                elif policy.should_retry(e, method, attempt):
+                    await asyncio.sleep(policy.delay(attempt))
+                    attempt += 1
+                else:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.retry(request_path)
+                continue
+            if breaker is not None:
+                breaker.record(request_path)
+            return result
+
+    async def _send(self, method, request_path, params, add_path, add_header, data, info=None) -> dict:
+        request_path = self._build_path(method, request_path, params, add_path)
+        if method == c.POST and data is None:
+            data = self.serializer.dumps(params)
+        if info is not None and method == c.POST:
+            info.bytes_out = body_size(data)
+        return await self._http(method, request_path, add_header, data, info)
+
+    async def _http(self, method, request_path, add_header, data, info=None) -> dict:
+        try:
+            async with self.session.request(method, self.base_url + request_path, headers=add_header,
+                                            data=data if method == c.POST else None) as response:
+                body = await response.read()
+                status = response.status
+        except asyncio.TimeoutError as e:
+            raise exceptions.WorkRequestException('Request timeout: {}'.format(e))
+        except aiohttp.ClientError as e:
+            raise exceptions.WorkRequestException('Connection error: {}'.format(e))
+        if info is not None:
+            info.bytes_in = len(body)
+
+        try:
+            rtn = self.serializer.loads(body)
+        except ValueError:
+            if not str(status).startswith('2'):
+                raise exceptions.WorkException(response, {'errcode': status, 'errmsg': body.decode('utf-8', 'replace')})
+            raise exceptions.WorkRequestException('Invalid Response: {}'.format(body.decode('utf-8', 'replace')))
+        if str(status).startswith('2') and rtn['errcode'] == 0:
+            return rtn
+        raise exceptions.WorkException(response, rtn)
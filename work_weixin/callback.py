@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from aiohttp import web
+except ImportError:  # pragma: no cover
+    web = None
+
+from . import exceptions
+from .crypto import WXBizMsgCrypt
+
+logger = logging.getLogger(__name__)
+
+
+def parse_xml(text: str) -> dict:
+    """明文xml转为 dict, 只取第一层节点(嵌套节点转为 dict)"""
+    def convert(node):
+        if len(node) == 0:
+            return node.text
+        return {child.tag: convert(child) for child in node}
+
+    return convert(ET.fromstring(text))
+
+
+class CallbackServer(object):
+    """接收企业微信的回调(消息及事件)
+
+    校验签名并解密后立即应答, 消息放入队列由后台任务分发给处理函数,
+    处理函数耗时不影响在5秒内应答. 协程函数在事件循环中执行, 普通函数在线程池中执行.
+    应答为空串, 不支持被动回复; 需要回复时在处理函数中调用 Client.send_msg.
+
+    Examples
+    --------
+    >>> server = CallbackServer(token, encoding_aes_key, corpid)
+    >>> @server.on(msg_type='event', event='click')
+    ... def on_click(msg):
+    ...     client.send_text_touser(msg['FromUserName'], 'clicked ' + msg['EventKey'])
+    >>> server.run(port=8080)
+    """
+
+    def __init__(self, token: str, encoding_aes_key: str, corpid: str, path: str = '/callback', workers: int = 16,
+                 executor_workers: int = 16, queue_size: int = 10000, max_age: float = 300):
+        """
+        :param token: 回调配置中的 Token
+        :param encoding_aes_key: 回调配置中的 EncodingAESKey
+        :param corpid: 企业ID
+        :param path: 回调URL的路径
+        :param workers: 分发消息的协程数
+        :param executor_workers: 执行普通(阻塞)处理函数的线程数
+        :param queue_size: 待处理消息的上限, 超出时应答 503, 由企业微信重试
+        :param max_age: 拒绝 timestamp 与本机时间相差超过该秒数的请求(防重放); None 为不检查
+        """
+        self.crypt = WXBizMsgCrypt(token, encoding_aes_key, corpid, max_age)
+        self.path: str = path
+        self.workers: int = workers
+        self.executor_workers: int = executor_workers
+        self.queue_size: int = queue_size
+        self._handlers: dict = {}
+        self._queue: asyncio.Queue = None
+        self._tasks: list = []
+        self._executor: ThreadPoolExecutor = None
+        self.stats: dict = {'received': 0, 'handled': 0, 'rejected': 0, 'errors': 0}
+
+    def on(self, msg_type: str = None, event: str = None):
+        """
+        注册处理函数的装饰器, handler(msg: dict)
+
+        :param msg_type: MsgType, 如 text/image/event; None 为全部
+        :param event: Event, 如 click/view/enter_agent (msg_type 为 event 时); None 为全部
+        """
+        def decorator(handler):
+            self.add_handler(handler, msg_type, event)
+            return handler
+        return decorator
+
+    def add_handler(self, handler, msg_type: str = None, event: str = None):
+        if event is not None:
+            event = event.lower()
+        self._handlers.setdefault((msg_type, event), []).append(handler)
+
+    def _match(self, msg: dict) -> list:
+        msg_type, event = msg.get('MsgType'), msg.get('Event')
+        if isinstance(event, str):
+            event = event.lower()
+        keys = [(msg_type, event)]
+        if event is not None:
+            keys.append((msg_type, None))
+        if msg_type is not None:
+            keys.append((None, None))
+        handlers = []
+        for key in keys:
+            handlers += self._handlers.get(key, [])
+        return handlers
+
+    async def start(self):
+        """启动分发任务"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='work_weixin-callback')
+        self._tasks = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self, drain: bool = True):
+        """停止分发任务
+
+        :param drain: 先处理完队列中的消息
+        """
+        if self._queue is None:
+            return
+        if drain:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._queue, self._tasks = None, []
+
+    async def join(self):
+        """等待队列中的消息全部处理完"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            msg = await self._queue.get()
+            try:
+                failed = False
+                for handler in self._match(msg):
+                    # 各 handler 分别处理异常, 一个失败不影响其他 handler
+                    try:
+                        if asyncio.iscoroutinefunction(handler):
+                            await handler(msg)
+                        else:
+                            await loop.run_in_executor(self._executor, handler, msg)
+                    except Exception:
+                        logger.exception('callback handler %r failed for %s/%s', handler,
+                                         msg.get('MsgType'), msg.get('Event'))
+                        self.stats['errors'] += 1
+                        failed = True
+                if not failed:
+                    self.stats['handled'] += 1
+            finally:
+                self._queue.task_done()
+
+    async def handle(self, method: str, query: dict, body: bytes = b''):
+        """
+        处理一次回调请求, 与具体的 web 框架无关
+
+        :param method: GET(验证URL) or POST(推送消息)
+        :param query: URL参数, 含 msg_signature, timestamp, nonce, (echostr)
+        :param body: POST 的内容
+        :return: (http status, 应答内容)
+        """
+        await self.start()
+        try:
+            if method == 'GET':
+                return 200, self.crypt.verify_url(query['msg_signature'], query['timestamp'], query['nonce'],
+                                                  query['echostr'])
+            msg = parse_xml(self.crypt.decrypt_msg(body, query['msg_signature'], query['timestamp'], query['nonce']))
+        except (KeyError, exceptions.WorkCallbackException, ET.ParseError):
+            return 403, ''
+        self.stats['received'] += 1
+        try:
+            self._queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return 503, ''
+        return 200, ''
+
+    async def _web_handler(self, request):
+        body = await request.read() if request.method == 'POST' else b''
+        status, text = await self.handle(request.method, dict(request.query), body)
+        return web.Response(status=status, text=text)
+
+    def app(self):
+        """aiohttp 的 Application, 可挂到已有的 aiohttp 服务上"""
+        if web is None:
+            raise ImportError('CallbackServer.app requires aiohttp: pip install aiohttp')
+        app = web.Application()
+        app.router.add_route('GET', self.path, self._web_handler)
+        app.router.add_route('POST', self.path, self._web_handler)
+
+        async def on_cleanup(app):
+            await self.stop()
+
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+    def run(self, host: str = '0.0.0.0', port: int = 8080):
+        """以 aiohttp 启动服务(阻塞)"""
+        web.run_app(self.app(), host=host, port=port)
+
+
+class CallbackSimulator(object):
+    """模拟企业微信推送回调, 用于本地测试
+
+    Examples
+    --------
+    >>> simulator = CallbackSimulator(server)
+    >>> await simulator.push({'ToUserName': corpid, 'FromUserName': 'zhangsan', 'MsgType': 'event',
+    ...                       'Event': 'click', 'EventKey': 'v001', 'AgentID': '1'})
+    """
+
+    def __init__(self, server: CallbackServer = None, token: str = None, encoding_aes_key: str = None,
+                 corpid: str = None):
+        """
+        :param server: 直接调用 server.handle, 不经过网络; 为 None 时须提供后面的参数, 用 push_url 经 HTTP 推送
+        """
+        self.server: CallbackServer = server
+        self.crypt = server.crypt if server is not None else WXBizMsgCrypt(token, encoding_aes_key, corpid)
+
+    def make_request(self, msg: dict):
+        """
+        生成推送请求
+
+        :return: (query, body)
+        """
+        xml = '<xml>{}</xml>'.format(''.join('<{0}><![CDATA[{1}]]></{0}>'.format(k, v) for k, v in msg.items()))
+        timestamp, nonce = str(int(time.time())), os.urandom(8).hex()
+        encrypt = self.crypt.encrypt(xml)
+        body = '<xml><ToUserName><![CDATA[{}]]></ToUserName><Encrypt><![CDATA[{}]]></Encrypt>' \
+               '<AgentID><![CDATA[{}]]></AgentID></xml>'.format(msg.get('ToUserName', ''), encrypt,
+                                                                msg.get('AgentID', ''))
+        query = {'msg_signature': self.crypt.signature(timestamp, nonce, encrypt), 'timestamp': timestamp,
+                 'nonce': nonce}
+        return query, body.encode('utf-8')
+
+    def make_verify(self, echostr: str = 'echo'):
+        """生成验证URL的请求参数"""
+        timestamp, nonce = str(int(time.time())), os.urandom(8).hex()
+        encrypt = self.crypt.encrypt(echostr)
+        return {'msg_signature': self.crypt.signature(timestamp, nonce, encrypt), 'timestamp': timestamp,
+                'nonce': nonce, 'echostr': encrypt}
+
+    async def push(self, msg: dict):
+        """推送一条消息给 server, 返回 (status, 应答内容)"""
+        query, body = self.make_request(msg)
+        return await self.server.handle('POST', query, body)
+
+    async def push_url(self, session, url: str, msg: dict):
+        """经 HTTP 推送一条消息
+
+        :param session: aiohttp.ClientSession
+        :return: (status, 应答内容)
+        """
+        query, body = self.make_request(msg)
+        async with session.post(url, params=query, data=body) as response:
+            return response.status, await response.text()
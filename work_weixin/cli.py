@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @desc    : 命令行批量发送: 从 CSV/JSON lines 逐行读取接收人及消息, 并发发送, 可断点续发
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import consts as c, exceptions
+from .client import Client
+from .ratelimit import RateLimiter
+from .transport import Transport
+
+ENV_PREFIX = 'WORK_WEIXIN_'
+'''corpid/secret/agentid 也可由环境变量 WORK_WEIXIN_CORPID 等提供'''
+
+
+def read_rows(f, fmt: str):
+    """
+    逐行读取, 不整个读入内存
+
+    :param f: 文本文件对象
+    :param fmt: csv or jsonl
+    :return: 生成器, 每行一个 dict
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def build_message(row: dict, template: str = None, msgtype: str = 'text') -> dict:
+    """
+    行 -> send_msg 的参数
+
+    行中的字段: touser, toparty, totag, msgtype, content.
+    content 为 dict(JSON lines)或 JSON 字符串时原样作为消息内容, 为普通字符串时作为 text/markdown 的 content;
+    指定 template 时以行中的字段格式化, 如 "{name}, 你的工资条已发放".
+    """
+    msgtype = row.get('msgtype') or msgtype
+    content = template.format(**row) if template is not None else row.get('content', '')
+    if isinstance(content, str) and content.startswith('{'):
+        try:
+            content = json.loads(content)
+        except ValueError:
+            pass
+    if not isinstance(content, dict):
+        content = {'content': content}
+    return {'touser': row.get('touser') or '', 'toparty': row.get('toparty') or '', 'totag': row.get('totag') or '',
+            'msgtype': msgtype, 'content': content}
+
+
+class Checkpoint(object):
+    """断点: 已完成的行号
+
+    每完成一行即写入结果日志; 检查点文件定期记录连续完成的行数及此时结果日志的位置,
+    续发时从该位置读取日志中之后完成的行, 跳过已完成的行, 不必读取整个日志.
+    """
+
+    def __init__(self, path: str, log_path: str):
+        self.path: str = path
+        self.log_path: str = log_path
+        self.done: int = 0
+        '''行号小于 done 的均已完成'''
+        self._ahead: set = set()
+        '''已完成但不连续的行号(并发时乱序完成)'''
+
+    def load(self):
+        """读取检查点及其后的结果日志"""
+        offset = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.done, offset = state['done'], state['log_offset']
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        self.mark(json.loads(line)['row'])
+                    except (ValueError, KeyError):
+                        pass  # 中断时写了一半的行
+        return self
+
+    def is_done(self, row: int) -> bool:
+        return row < self.done or row in self._ahead
+
+    def mark(self, row: int):
+        if row < self.done:
+            return
+        self._ahead.add(row)
+        while self.done in self._ahead:
+            self._ahead.remove(self.done)
+            self.done += 1
+
+    def save(self, log_offset: int):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'done': self.done, 'log_offset': log_offset, 'time': time.time()}, f)
+        os.replace(tmp, self.path)
+
+
+class BatchSender(object):
+    """并发发送, 同时在途的行数有上限, 内存占用与文件大小无关"""
+
+    def __init__(self, client: Client, log_path: str, checkpoint_path: str, concurrency: int = 8,
+                 checkpoint_interval: float = 5, template: str = None, msgtype: str = 'text', progress=None):
+        """
+        :param client: Client
+        :param log_path: 结果日志(JSON lines), 每行一条
+        :param checkpoint_path: 检查点文件
+        :param concurrency: 并发数
+        :param checkpoint_interval: 写检查点的间隔(秒)
+        :param template: 消息模板, 见 build_message
+        :param msgtype: 行中未指定 msgtype 时的类型
+        :param progress: 进度回调 progress(stats)
+        """
+        self.client: Client = client
+        self.concurrency: int = concurrency
+        self.checkpoint_interval: float = checkpoint_interval
+        self.template: str = template
+        self.msgtype: str = msgtype
+        self.progress = progress
+        self.checkpoint = Checkpoint(checkpoint_path, log_path).load()
+        self.stats: dict = {'sent': 0, 'failed': 0, 'skipped': 0}
+        # 行缓冲: 进程被杀时已完成的行都已写入
+        self._log = open(log_path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(concurrency * 2)
+        self._saved_at: float = time.monotonic()
+
+    def run(self, rows) -> dict:
+        """
+        :param rows: 行的迭代器, 行号从 0 开始
+        :return: stats
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i, row in enumerate(rows):
+                if self.checkpoint.is_done(i):
+                    self.stats['skipped'] += 1
+                    continue
+                self._slots.acquire()
+                executor.submit(self._send, i, row)
+        with self._lock:
+            self._log.flush()
+            self.checkpoint.save(self._log.tell())
+        self._log.close()
+        return self.stats
+
+    def _send(self, i: int, row: dict):
+        record = {'row': i}
+        try:
+            message = build_message(row, self.template, self.msgtype)
+            record.update(touser=message['touser'], toparty=message['toparty'], totag=message['totag'])
+            result = self.client.send_msg(**message)
+            record.update(errcode=result.get('errcode', 0), errmsg=result.get('errmsg', 'ok'))
+            for key in ('invaliduser', 'invalidparty', 'invalidtag'):
+                if result.get(key):
+                    record[key] = result[key]
+        except exceptions.WorkException as e:
+            record.update(errcode=e.code, errmsg=e.message)
+        except Exception as e:
+            record.update(errcode=-1, errmsg='{}: {}'.format(type(e).__name__, e))
+        finally:
+            self._slots.release()
+        record['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._log.write(line)
+            self.stats['sent' if record['errcode'] == 0 else 'failed'] += 1
+            self.checkpoint.mark(i)
+            now = time.monotonic()
+            if now - self._saved_at >= self.checkpoint_interval:
+                # 先落盘日志再写检查点, 检查点之前的行一定在日志中
+                self._log.flush()
+                self.checkpoint.save(self._log.tell())
+                self._saved_at = now
+                if self.progress is not None:
+                    self.progress(dict(self.stats))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='work_weixin', description='从 CSV/JSON lines 批量发送企业微信消息, 中断后再次运行同样的命令即从断点继续',
+        epilog='CSV 需有表头, 列: touser, toparty, totag, msgtype(可选), content; '
+               'JSON lines 每行一个对象, 字段相同, content 可为 dict')
+    parser.add_argument('input', help='输入文件, - 为 stdin')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='默认按扩展名判断, stdin 默认 jsonl')
+    parser.add_argument('--corpid', default=os.environ.get(ENV_PREFIX + 'CORPID'))
+    parser.add_argument('--secret', default=os.environ.get(ENV_PREFIX + 'SECRET'))
+    parser.add_argument('--agentid', default=os.environ.get(ENV_PREFIX + 'AGENTID'))
+    parser.add_argument('--template', help='消息模板, 以行中的字段格式化, 如 "{name}, 你的工资条已发放"')
+    parser.add_argument('--msgtype', default='text', help='行中未指定 msgtype 时的类型, 默认 text')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数, 默认 8')
+    parser.add_argument('--rate', type=float, help='每秒最多发送的请求数, 默认不限(仍遵守接口上限)')
+    parser.add_argument('--log', help='结果日志, 默认 <input>.result.jsonl')
+    parser.add_argument('--checkpoint', help='检查点文件, 默认 <log>.checkpoint')
+    parser.add_argument('--checkpoint-interval', type=float, default=5, help='写检查点的间隔(秒), 默认 5')
+    parser.add_argument('--encoding', default='utf-8', help='输入文件编码, 默认 utf-8 (Excel 导出的 CSV 可用 utf-8-sig/gbk)')
+    parser.add_argument('--api-url', default=c.API_URL, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    for name in ('corpid', 'secret', 'agentid'):
+        if not getattr(args, name):
+            parser.error('--{0} 或环境变量 {1}{2} 必须提供'.format(name, ENV_PREFIX, name.upper()))
+    if args.format is None:
+        args.format = 'csv' if args.input.lower().endswith('.csv') else 'jsonl'
+    if args.log is None:
+        args.log = ('stdin' if args.input == '-' else args.input) + '.result.jsonl'
+    if args.checkpoint is None:
+        args.checkpoint = args.log + '.checkpoint'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rate_limiter = RateLimiter(limits={c.SEND_MSG: (args.rate, 1)}) if args.rate else RateLimiter()
+    client = Client(args.corpid, args.secret, args.agentid, load_directory=False, rate_limiter=rate_limiter,
+                    transport=Transport(base_url=args.api_url, pool_size=args.concurrency))
+
+    def progress(stats):
+        print('sent {sent}, failed {failed}, skipped {skipped}'.format(**stats), file=sys.stderr)
+
+    sender = BatchSender(client, args.log, args.checkpoint, args.concurrency, args.checkpoint_interval,
+                         args.template, args.msgtype, progress)
+    if args.input == '-':
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding, newline='')
+    else:
+        f = open(args.input, encoding=args.encoding, newline='')
+    try:
+        stats = sender.run(read_rows(f, args.format))
+    except KeyboardInterrupt:
+        print('interrupted, run the same command again to resume', file=sys.stderr)
+        return 130
+    finally:
+        f.close()
+        client.close()
+    progress(stats)
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,45 +1,328 @@
 import requests
 from requests_toolbelt import MultipartEncoder
-import json
+import functools
 import os
 import random
 import string
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from . import consts as c, utils, exceptions
+from .transport import Transport
+from .token import TokenManager, TokenStore, token_key
+from .snapshot import DirectorySnapshot
+from .ratelimit import RateLimiter
+from .media_cache import MediaCache
+from .directory import Directory, DirectoryCache
+from .metrics import Metrics, body_size
+from .serializer import default_serializer
+from .template import MessageTemplate, ContentTemplate
+from .retry import RetryPolicy, CircuitBreaker
+from .invalid_cache import InvalidRecipientCache
 
 
-class Client(object):
+class BaseClient(object):
+    """Client 与 AsyncClient 共用的请求组装逻辑, 不涉及网络"""
 
-    def __init__(self, corpid: str = 'corpid', secret: str = 'secret', agentid='agentid'):
+    agent_id: str = ''
+    access_token: str = ''
+    serializer = None
+    _templates: dict = None
+    invalid_cache: InvalidRecipientCache = None
+
+    def _build_path(self, method, request_path, params: dict = {}, add_path: dict = {}) -> str:
+        """拼接请求路径: access_token, agentid 及 GET 参数"""
+        # url 中增加 access_token 参数
+        access_token = self.access_token
+        if len(access_token) > 0:
+            request_path += f'?access_token={access_token}&agentid={self.agent_id}'
+        for k, v in add_path.items():
+            request_path += '&{}={}'.format(k, v)
+        if method == c.GET:
+            if len(access_token) > 0:
+                request_path += '&' + utils.parse_params_to_str(params)[1:]  # 用&替换掉?
+            else:
+                request_path = request_path + utils.parse_params_to_str(params)
+        return request_path
+
+    def _msg_params(self, touser: str = '', toparty: str = '', totag: str = '', msgtype: str = 'text',
+                    content: dict = {}) -> dict:
+        """组装 send_msg 的请求参数"""
+        params: dict = {
+            'touser': touser,
+            'toparty': toparty,
+            'totag': totag,
+            'msgtype': msgtype,
+            'agentid': self.agent_id,
+            'safe': 0
+        }
+        params[msgtype] = content
+        return params
+
+    def _msg_template(self, msgtype: str) -> MessageTemplate:
+        """send_msg 的预编译请求体, 按 msgtype 缓存"""
+        template = self._templates.get(msgtype)
+        if template is None:
+            template = self._templates[msgtype] = MessageTemplate(self.agent_id, msgtype, serializer=self.serializer)
+        return template
+
+    @staticmethod
+    def _split_recipients(touser='', toparty='', totag='') -> list:
+        """按接口上限拆分接收人
+
+        :param touser: "UserID1|UserID2" 或 list
+        :return: [(touser, toparty, totag), ...], 每批均为 "|" 连接的字符串
+        """
+        def split(ids, size):
+            if not isinstance(ids, (list, tuple, set, frozenset)):
+                ids = [id for id in str(ids).split('|') if id]
+            ids = [str(id) for id in ids]
+            return ['|'.join(ids[i:i + size]) for i in range(0, len(ids), size)]
+
+        if touser == '@all':
+            return [('@all', '', '')]
+        users = split(touser, c.MAX_TOUSER)
+        parties = split(toparty, c.MAX_TOPARTY)
+        tags = split(totag, c.MAX_TOTAG)
+        count = max(len(users), len(parties), len(tags), 1)
+        return [(users[i] if i < len(users) else '', parties[i] if i < len(parties) else '',
+                 tags[i] if i < len(tags) else '') for i in range(count)]
+
+    @staticmethod
+    def _recipient_keys(batch: tuple) -> list:
+        """限流用的接收人键, @all 按整个应用计"""
+        touser, toparty, totag = batch
+        keys = ['user:' + id for id in touser.split('|') if id]
+        keys += ['party:' + id for id in toparty.split('|') if id]
+        keys += ['tag:' + id for id in totag.split('|') if id]
+        return keys
+
+    @staticmethod
+    def _merge_results(batches: list, results: list) -> dict:
+        """合并分批发送的结果
+
+        :param batches: _split_recipients 的结果
+        :param results: 每批的返回结果, 与 batches 一一对应
+        :return: dict, errcode 为第一个失败批次的 errcode, invalid* 为各批合并, batches 为每批的状态
+        """
+        merged: dict = {'errcode': 0, 'errmsg': 'ok', 'invaliduser': '', 'invalidparty': '', 'invalidtag': '',
+                        'batches': []}
+        for (touser, toparty, totag), result in zip(batches, results):
+            if result['errcode'] != 0 and merged['errcode'] == 0:
+                merged['errcode'], merged['errmsg'] = result['errcode'], result['errmsg']
+            for key in ('invaliduser', 'invalidparty', 'invalidtag'):
+                if result.get(key):
+                    merged[key] = result[key] if not merged[key] else merged[key] + '|' + result[key]
+            merged['batches'].append({'touser': touser, 'toparty': toparty, 'totag': totag, **result})
+        return merged
+
+    def _merge_bulk(self, groups: list, results: list) -> dict:
+        """合并 send_bulk 各组的结果
+
+        :param groups: [(编码后的内容, [userid, ...]), ...]
+        :param results: 各组 send_msg 的结果(或 _error_result), 与 groups 一一对应
+        """
+        batches, batch_results = [], []
+        for (_, users), result in zip(groups, results):
+            if 'batches' in result:
+                for batch in result['batches']:
+                    batches.append((batch['touser'], batch['toparty'], batch['totag']))
+                    batch_results.append({k: v for k, v in batch.items() if k not in ('touser', 'toparty', 'totag')})
+            else:
+                batches.append(('|'.join(users), '', ''))
+                batch_results.append(result)
+        merged = self._merge_results(batches, batch_results)
+        merged['groups'] = len(groups)
+        return merged
+
+    def _filter_invalid(self, touser: str, toparty: str, totag: str) -> tuple:
+        """去掉 invalid_cache 中的无效接收人
+
+        :return: (touser, toparty, totag, skipped), 见 InvalidRecipientCache.filter
+        """
+        if self.invalid_cache is None:
+            return touser, toparty, totag, None
+        return self.invalid_cache.filter(touser, toparty, totag, (self.corp_id, str(self.agent_id)))
+
+    @staticmethod
+    def _add_skipped(result: dict, skipped: dict) -> dict:
+        """把发送前去掉的接收人并入返回结果的 invalid*, 与接口返回的一致"""
+        if not skipped:
+            return result
+        for key, ids in skipped.items():
+            if not result.get(key):
+                result[key] = ids
+            elif ids:
+                result[key] += '|' + ids
+        return result
+
+    def _record_invalid(self, batch: tuple, result: dict = None, error: Exception = None):
+        """单批发送后记录无效接收人; 接收人全部无效时接口返回 81013, 整批记录"""
+        scope = (self.corp_id, str(self.agent_id))
+        if result is not None:
+            self.invalid_cache.record(result, scope)
+        elif isinstance(error, exceptions.WorkException) and error.code == c.ERR_ALL_INVALID_RECIPIENTS:
+            self.invalid_cache.add(*batch, scope=scope)
+
+    @staticmethod
+    def _error_result(e: Exception) -> dict:
+        """分批发送时, 把单批的异常转为返回结果"""
+        if isinstance(e, exceptions.WorkException):
+            return {'errcode': e.code, 'errmsg': e.message}
+        return {'errcode': -1, 'errmsg': str(e)}
+
+    @staticmethod
+    def _media_type(file_name: str):
+        """根据扩展名取素材类型
+
+        :return: (type, content_type)
+        """
+        ext = os.path.splitext(file_name)
+        if len(ext) > 1:
+            ext = ext[1][1:]
+            if ext in ['jpg', 'png', 'bmp']:
+                type = 'image'
+                content_type = '{}/{}'.format(type, ext)
+            elif ext in ['amr']:
+                type = 'voice'
+                content_type = '{}/{}'.format(type, ext)
+            elif ext in ['mp4']:
+                type = 'video'
+                content_type = '{}/{}'.format(type, ext)
+            else:
+                type = 'file'
+                content_type = 'application/octet-stream'
+        else:
+            type = 'file'
+            content_type = 'application/octet-stream'
+        return type, content_type
+
+
+class Client(BaseClient):
+
+    def __init__(self, corpid: str = 'corpid', secret: str = 'secret', agentid='agentid', transport: Transport = None,
+                 pool_size: int = 10, timeout: tuple = (3.05, 10), deadline: float = None, preconnect: bool = False,
+                 token_store: TokenStore = None, load_directory: bool = True, directory_workers: int = 8,
+                 snapshot: DirectorySnapshot = None, send_workers: int = 8, rate_limiter: RateLimiter = None,
+                 media_cache: MediaCache = None, tokens: TokenManager = None, directory: DirectoryCache = None,
+                 metrics: Metrics = None, serializer=None, retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None, invalid_cache: InvalidRecipientCache = None):
         """
         初始化接口
 
         :param corpid: 企业ID
         :param secret: 安全码
         :param agentid: 部门ID
+        :param transport: 共用的连接池, 为 None 时按后面的参数新建; 传入的连接池由调用方关闭
+        :param pool_size: 连接池大小
+        :param timeout: (连接超时, 读取超时) 秒
+        :param deadline: 单次调用的总时限(秒)
+        :param preconnect: 是否在后台预先建立连接
+        :param token_store: token 存储, 默认进程内共用; 多进程共用可用 FileTokenStore/SQLiteTokenStore
+        :param load_directory: 是否加载部门及司员信息(首次访问 departments/users 时加载), 仅发消息时可设为 False
+        :param directory_workers: 加载司员信息的并发数
+        :param snapshot: 部门及司员的本地快照, 也可传入文件路径; 启动时优先读快照, 过期则在后台刷新
+        :param send_workers: 接收人超过接口上限分批发送时的并发数
+        :param rate_limiter: 按接口及接收人限流, 超出时等待(按 corpid, agentid 分别计算, 可共用); None 为不限流
+        :param media_cache: 按文件内容缓存 media_id, 同样的文件在有效期内不再重复上传(按 corpid 分别缓存, 可共用)
+        :param tokens: 共用的 TokenManager(同一 corpid/secret), 为 None 时新建
+        :param directory: 共用的 DirectoryCache(同一企业), 为 None 时按 load_directory/snapshot 新建
+        :param metrics: 按接口统计耗时、errcode 等, 可由多个 Client 共用; None 为不统计
+        :param serializer: 请求及返回的 json 序列化, 默认安装了 orjson 时用 orjson, 否则用标准库
+        :param retry_policy: token 失效时刷新并重放, 接口繁忙时退避重试; 默认 RetryPolicy(), 不重试用 RetryPolicy.disabled()
+        :param circuit_breaker: 按接口熔断, 接口持续不可用时直接失败; None 为不熔断
+        :param invalid_cache: 无效接收人的缓存, 发送前去掉本应用已知无效的接收人(按 corpid, agentid 分别记录, 可共用); None 为不缓存
         """
 
+        self.corp_id: str = corpid
         self.agent_id: str = agentid
-        self.access_token: str = ''
-        # token所有请求均会用到
+        self.send_workers: int = send_workers
+        self.rate_limiter: RateLimiter = rate_limiter
+        self.media_cache: MediaCache = media_cache
+        self.metrics: Metrics = metrics
+        self.serializer = serializer or default_serializer()
+        self._templates: dict = {}
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy()
+        self.circuit_breaker: CircuitBreaker = circuit_breaker
+        self.invalid_cache: InvalidRecipientCache = invalid_cache
+        self._own_transport: bool = transport is None
+        self.transport: Transport = transport or Transport(pool_size=pool_size, connect_timeout=timeout[0],
+                                                           read_timeout=timeout[1], deadline=deadline,
+                                                           preconnect=preconnect)
+        # token所有请求均会用到, 按 expires_in 缓存并提前刷新
+        self._secret: str = secret
+        self.tokens: TokenManager = tokens or TokenManager(self._fetch_token, token_key(corpid, secret), token_store)
+        self.tokens.get()
+
+        # 部门及司员在首次访问时加载
+        self.directory_workers: int = directory_workers
+        self.directory_cache: DirectoryCache = directory or DirectoryCache(self._fetch_directory, snapshot, load_directory)
+        if invalid_cache is not None and directory is None:
+            # 重新加载后, 又出现在通讯录中的司员及部门不再视为无效;
+            # 传入的 directory 按加载它的应用的可见范围返回, 不据此移除本应用的记录
+            self.directory_cache.add_listener(functools.partial(invalid_cache.revalidate,
+                                                                scope=(self.corp_id, str(self.agent_id))))
+
+    @property
+    def access_token(self) -> str:
+        return self.tokens.get()
+
+    def _fetch_token(self):
+        """请求 gettoken
 
-        result = self._request(c.GET, c.GET_ACCESS_TOKEN, {'corpid': corpid, 'corpsecret': secret})
-        if result['errcode'] == 0:
-            self.access_token = result['access_token']
+        :return: (access_token, expires_in)
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(c.GET_ACCESS_TOKEN, corpid=self.corp_id)
+        path = c.GET_ACCESS_TOKEN + utils.parse_params_to_str({'corpid': self.corp_id, 'corpsecret': self._secret})
+        if self.metrics is None:
+            result = self._parse_response(self.transport.request(c.GET, path), self.serializer.loads)
         else:
-            raise exceptions.WorkException(result)
+            with self.metrics.track(c.GET_ACCESS_TOKEN, c.GET) as info:
+                response = self.transport.request(c.GET, path)
+                info.bytes_in = len(response.content)
+                result = self._parse_response(response, self.serializer.loads)
+        return result['access_token'], result.get('expires_in', 7200)
+
+    @property
+    def directory(self) -> Directory:
+        """部门及司员(带索引)"""
+        return self.directory_cache.get()
+
+    @property
+    def departments(self) -> dict:
+        """部门结构 {id: department}, 首次访问时由索引生成 dict; 查询子树、成员用 directory"""
+        return self.directory.departments
+
+    @property
+    def users(self) -> dict:
+        """司员信息 {userid: user}, 首次访问时由索引生成 dict; 按姓名、部门查询用 directory"""
+        return self.directory.users
+
+    @property
+    def snapshot(self) -> DirectorySnapshot:
+        return self.directory_cache.snapshot
+
+    def load_directory(self):
+        """(重新)加载部门及司员信息, 配置了快照时加载完成后写入快照"""
+        self.directory_cache.reload()
 
-        self.departments: dict = {}
-        '''部门结构'''
+    def refresh_directory(self):
+        """在后台重新加载部门及司员信息, 完成后替换; 加载期间继续使用原数据"""
+        self.directory_cache.refresh()
 
-        self.users: dict = {}
-        '''司员信息'''
+    def _fetch_directory(self):
+        """从接口加载部门及司员信息
 
-        # 取部门
-        self._get_departments()
-        # 取司员
-        for id in self.departments.keys():
-            self._get_users(id)
+        先取全部部门, 再从各顶层部门以 fetch_child=1 一次取整棵子树的司员;
+        某个子树取不到时(如超出权限), 改为并发获取其下各子部门.
+
+        :return: (departments, users)
+        """
+        departments = self._get_departments()
+        return departments, self._get_all_users(departments)
 
     def _get_departments(self) -> dict:
         """获取组织结构
@@ -48,51 +331,129 @@ class Client(object):
         -------
         result : dict of departments
             {
-                "errcode": 0,
-                "errmsg": "ok",
-                "department": [
-                    {
-                        "id": 73,
-                        "name": "金融创新部",
-                        "parentid": 3,
-                        "order": 999999987
-                    }
-                ]
+                73: {
+                    "id": 73,
+                    "name": "金融创新部",
+                    "parentid": 3,
+                    "order": 999999987
+                }
             }
 
         """
         result = self._request(c.GET, c.GET_DEPARTMENT)
-        for part in result['department']:
-            self.departments[part['id']] = part
+        return {part['id']: part for part in result['department']}
 
-    def _get_users(self, department_id: int = 0):
+    def _get_users(self, department_id: int = 0, fetch_child: int = 0) -> dict:
         """
         获取司员信息
 
         :param department_id: 部门ID
+        :param fetch_child: 1 则递归获取子部门的司员
         :return:
 {
-   "errcode": 0,
-   "errmsg": "ok",
-   "userlist": [
-           {
-                  "userid": "zhangsan",
-                  "name": "李四",
-                  "department": [1, 2]
-           }
-     ]
+    "zhangsan": {
+          "userid": "zhangsan",
+          "name": "李四",
+          "department": [1, 2]
+    }
 }
         """
 
-        result = self._request(c.GET, c.GET_USER_LIST, {'department_id': department_id})
-        for user in result['userlist']:
-            self.users[user['userid']] = user
+        result = self._request(c.GET, c.GET_USER_LIST, {'department_id': department_id, 'fetch_child': fetch_child})
+        return {user['userid']: user for user in result['userlist']}
+
+    def _get_all_users(self, departments: dict) -> dict:
+        """从顶层部门批量获取全部司员, 失败的子树拆分后并发重试"""
+        children: dict = {}
+        for part in departments.values():
+            children.setdefault(part.get('parentid'), []).append(part['id'])
+        roots = [id for id, part in departments.items() if part.get('parentid') not in departments]
+
+        users: dict = {}
+        with ThreadPoolExecutor(max_workers=self.directory_workers) as executor:
+            pending = {executor.submit(self._get_users, id, 1): (id, 1) for id in roots}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    id, fetch_child = pending.pop(future)
+                    try:
+                        users.update(future.result())
+                    except (exceptions.WorkException, exceptions.WorkRequestException):
+                        if fetch_child == 0 or id not in children:
+                            raise
+                        # 拆分子树: 本部门的直属司员 + 各子部门的子树
+                        pending[executor.submit(self._get_users, id, 0)] = (id, 0)
+                        for child in children[id]:
+                            pending[executor.submit(self._get_users, child, 1)] = (child, 1)
+        return users
+
+    def iter_departments(self, department_id: int = None):
+        """逐个返回部门, 不写入 self.departments
+
+        :param department_id: 只返回该部门及其子部门, None 为全部
+        :return: 部门 dict 的生成器
+        """
+        params = {} if department_id is None else {'id': department_id}
+        result = self._request(c.GET, c.GET_DEPARTMENT, params)
+        yield from result['department']
+
+    def iter_users(self, page_size: int = 1000, prefetch: int = 2):
+        """按游标分页逐个返回司员, 不写入 self.users, 内存占用只与 page_size * prefetch 有关
+
+        后台线程预取后面的页(最多 prefetch 页), 调用方处理当前页时不必等待网络.
+
+        :param page_size: 每页条数, 最大 10000
+        :param prefetch: 最多预取的页数
+        :return: 生成器, 每个司员所在的每个部门各一条
+            {
+                "userid": "zhangsan",
+                "department": 1
+            }
+        """
+        pages = queue.Queue(maxsize=max(prefetch, 1))
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch():
+            cursor = ''
+            try:
+                while True:
+                    result = self._request(c.POST, c.GET_USER_LIST_ID, {'cursor': cursor, 'limit': page_size})
+                    if not put(result.get('dept_user', [])):
+                        return
+                    cursor = result.get('next_cursor', '')
+                    if not cursor:
+                        break
+                put(None)
+            except Exception as e:
+                put(e)
+
+        threading.Thread(target=fetch, name='work_weixin-iter_users', daemon=True).start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+        finally:
+            # 调用方提前结束迭代时, 通知预取线程退出
+            stopped.set()
 
     def send_text_touser(self, touser: str, msg: str):
         """
         发送消息给同事
 
-        :param touser:  "UserID1|UserID2|UserID3"
+        :param touser:  "UserID1|UserID2|UserID3" 或 list
         :param msg: "hello world!"
 
         :return: dict
@@ -104,7 +465,7 @@ class Client(object):
         """
         发送消息给同事
 
-        :param toparty:  "PartyID1|PartyID2"
+        :param toparty:  "PartyID1|PartyID2" 或 list
         :param msg: "hello world!"
 
         :return: dict
@@ -116,7 +477,7 @@ class Client(object):
         """
         发送消息给同事
 
-        :param totag: "TagID1|TagID2"
+        :param totag: "TagID1|TagID2" 或 list
         :param msg: "hello world!"
 
         :return: dict
@@ -124,7 +485,7 @@ class Client(object):
         """
         return self.send_msg(totag=totag, msgtype='text', content={'content': msg})
 
-    def send_img(self, touser: str = '', toparty: str = '', totag: str = '', media_id='') -> dict:
+    def send_img(self, touser: str = '', toparty: str = '', totag: str = '', media_id='', img_file: str = None) -> dict:
         """发送图片消息
 
         Parameters
@@ -135,8 +496,10 @@ class Client(object):
                 "PartyID1|PartyID2"
             totag :
                 "TagID1|TagID2"
+            media_id :
+                图片的 media_id
             img_file:
-                图片文件
+                图片文件, 代替 media_id; 先经 upload_tmp 上传(有 media_cache 时同样的文件不重复上传)
 
         Returns
         -------
@@ -150,19 +513,32 @@ class Client(object):
                 "invalidtag":"tagid1|tagid2"
             }
         """
+        if img_file is not None:
+            media_id = self.upload_tmp(img_file)['media_id']
         return self.send_msg(touser, toparty, totag, msgtype='image', content={'media_id': media_id})
 
+    def send_file(self, touser: str = '', toparty: str = '', totag: str = '', media_id='', file_name: str = None) -> dict:
+        """发送文件消息
+
+        :param media_id: 文件的 media_id
+        :param file_name: 文件, 代替 media_id; 先经 upload_tmp 上传(有 media_cache 时同样的文件不重复上传)
+        :return: 同 send_img
+        """
+        if file_name is not None:
+            media_id = self.upload_tmp(file_name)['media_id']
+        return self.send_msg(touser, toparty, totag, msgtype='file', content={'media_id': media_id})
+
     def send_msg(self, touser: str = '', toparty: str = '', totag: str = '', msgtype: str = 'text', content: dict = {}) -> dict:
         """
         发送消息
 
         Parameters
         ----------
-        touser : str, default ''
-            用户
-        toparty : str, default ''
+        touser : str or list, default ''
+            用户, "UserID1|UserID2" 或 list
+        toparty : str or list, default ''
             部门
-        totag : str, default ''
+        totag : str or list, default ''
             标签
         msgtype : str, default 'text'
             消息类型
@@ -181,6 +557,17 @@ class Client(object):
             }
             如果部分接收人无权限或不存在，发送仍然执行，但会返回无效的部分（即invaliduser或invalidparty或invalidtag），常见的原因是接收人不在应用的可见范围内。
 
+            接收人超过接口上限(touser 1000, toparty/totag 100)时自动分批并发发送, 返回合并的结果:
+            {
+                "errcode" : 0,  // 第一个失败批次的 errcode, 全部成功为 0
+                "errmsg" : "ok",
+                "invaliduser" : "userid1|userid2",  // 各批合并
+                "invalidparty" : "",
+                "invalidtag": "",
+                "batches": [{"touser": "...", "toparty": "", "totag": "", "errcode": 0, "errmsg": "ok", ...}]
+            }
+            所有批次都失败时抛出第一个批次的异常.
+
         Notes
         -----
         touser、toparty、totag不能同时为空，后面不再强调。
@@ -411,21 +798,81 @@ class Client(object):
 
         """
 
-        params: dict = {
-            'touser': touser,
-            'toparty': toparty,
-            'totag': totag,
-            'msgtype': msgtype,
-            'agentid': self.agent_id,
-            'safe': 0
-        }
-        params[msgtype] = content
-        result = self._request(c.POST, c.SEND_MSG, params)
+        touser, toparty, totag, skipped = self._filter_invalid(touser, toparty, totag)
+        if skipped and not (touser or toparty or totag):
+            # 接收人均已知无效, 不再请求
+            return self._add_skipped({'errcode': 0, 'errmsg': 'ok'}, skipped)
+
+        batches = self._split_recipients(touser, toparty, totag)
+        if len(batches) == 1:
+            return self._add_skipped(self._send_batch(batches[0], msgtype, content), skipped)
+
+        # 各批内容相同, 只编码一次
+        content = self._msg_template(msgtype).encode_content(content)
+        with ThreadPoolExecutor(max_workers=min(self.send_workers, len(batches))) as executor:
+            futures = [executor.submit(self._send_batch, batch, msgtype, content) for batch in batches]
+        results, errors = [], []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (exceptions.WorkException, exceptions.WorkRequestException) as e:
+                errors.append(e)
+                results.append(self._error_result(e))
+        if len(errors) == len(batches):
+            raise errors[0]
+        return self._add_skipped(self._merge_results(batches, results), skipped)
+
+    def send_bulk(self, template: ContentTemplate, recipients, common: dict = None) -> dict:
+        """
+        按接收人渲染模板后发送, 渲染结果相同的接收人合并为一次 send_msg(超过1000人时再分批)
+
+        :param template: ContentTemplate, 如 ContentTemplate('textcard', {'description': '{dept}的周报已生成', ...})
+        :param recipients: {userid: 变量} 或 [(userid, 变量), ...]
+        :param common: 所有接收人共用的变量
+        :return: dict, 同 send_msg 分批发送时的结果, 另有 groups 为不同内容的数量; 全部失败时抛出第一个异常
+        """
+        groups = list(template.group(recipients, common).items())
+        if not groups:
+            return self._merge_bulk([], [])
+
+        def send(group):
+            payload, users = group
+            return self.send_msg(touser=users, msgtype=template.msgtype, content=payload)
+
+        with ThreadPoolExecutor(max_workers=min(self.send_workers, len(groups))) as executor:
+            futures = [executor.submit(send, group) for group in groups]
+        results, errors = [], []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (exceptions.WorkException, exceptions.WorkRequestException) as e:
+                errors.append(e)
+                results.append(self._error_result(e))
+        if len(errors) == len(groups):
+            raise errors[0]
+        return self._merge_bulk(groups, results)
+
+    def _send_batch(self, batch: tuple, msgtype: str, content: dict) -> dict:
+        """发送一批(不超过接口上限的)接收人"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(recipients=self._recipient_keys(batch), corpid=self.corp_id,
+                                      agentid=self.agent_id)
+        data = self._msg_template(msgtype).render(*batch, content)
+        if self.invalid_cache is None:
+            return self._request(c.POST, c.SEND_MSG, data=data)
+        try:
+            result = self._request(c.POST, c.SEND_MSG, data=data)
+        except exceptions.WorkException as e:
+            self._record_invalid(batch, error=e)
+            raise
+        self._record_invalid(batch, result)
         return result
 
-    def upload_tmp(self, file_name: str) -> dict:
+    def upload_tmp(self, file_name: str, fileobj=None, progress=None) -> dict:
         """上传临时素材
 
+        文件内容分块流式上传, 不会整个读入内存.
+
         :param file_name:
             文件名
                 普通文件	application/octet-stream
@@ -434,6 +881,8 @@ class Client(object):
                 bmp图片	image/bmp
                 amr音频	voice/amr
                 mp4视频	video/mp4
+        :param fileobj: 文件对象(有 read 方法)或字节块的迭代器, 代替读取 file_name; 此时 file_name 只用于判断类型
+        :param progress: 进度回调 progress(已上传字节, 总字节, 每秒字节)
 
         :return: dict
             {
@@ -444,35 +893,118 @@ class Client(object):
                "created_at": "1380000000"
             }
         """
-        ext = os.path.splitext(file_name)
-        if len(ext) > 1:
-            ext = ext[1][1:]
-            if ext in ['jpg', 'png', 'bmp']:
-                type = 'image'
-                content_type = '{}/{}'.format(type, ext)
-            elif ext in ['amr']:
-                type = 'voice'
-                content_type = '{}/{}'.format(type, ext)
-            elif ext in ['mp4']:
-                type = 'video'
-                content_type = '{}/{}'.format(type, ext)
-            else:
-                type = 'file'
-                content_type = 'application/octet-stream'
-        else:
-            type = 'file'
-            content_type = 'application/octet-stream'
+        type, content_type = self._media_type(file_name)
+        if fileobj is not None:
+            if not hasattr(fileobj, 'read'):
+                fileobj = utils.spool_iterable(fileobj)
+            elif not (hasattr(fileobj, 'seekable') and fileobj.seekable()):
+                fileobj = utils.spool_iterable(iter(lambda: fileobj.read(1 << 16), b''))
+            return self._upload(file_name, fileobj, type, content_type, progress)
+        if self.media_cache is None:
+            with open(file_name, 'rb') as f:
+                return self._upload(file_name, f, type, content_type, progress)
+
+        digest = self.media_cache.digest(file_name)
+        item = self.media_cache.get(digest, type, self.corp_id)
+        if item is not None:
+            return {'errcode': 0, 'errmsg': 'ok', 'type': type, **item}
+        with open(file_name, 'rb') as f:
+            result = self._upload(file_name, f, type, content_type, progress)
+        self.media_cache.put(digest, type, result['media_id'], result.get('created_at'), self.corp_id)
+        return result
 
-        bs = open(file_name, 'rb').read()
+    def _upload(self, file_name: str, f, type: str, content_type: str, progress=None) -> dict:
+        f = utils.UploadReader(f, progress)
 
         # file中的第一个参数应为文件名, 但不能是中文, 故此处采用type替代亦可
-        m = MultipartEncoder({'name': 'media', 'filename': os.path.split(file_name)[1], 'file': ('name_no_cn', bs, content_type)})
+        m = MultipartEncoder({'name': 'media', 'filename': os.path.split(file_name)[1], 'file': ('name_no_cn', f, content_type)})
 
         header: dict = {}
         header[c.CONTENT_TYPE] = m.content_type
         result = self._request(c.POST, c.UPLOAD_TMP, params='', add_path={'type': type}, add_header=header, data=m)
         return result
 
+    def download_media(self, media_id: str, dest, chunk_size: int = 1 << 16, resume: bool = True) -> dict:
+        """下载临时素材
+
+        分块写入 dest, 内存占用与文件大小无关.
+        dest 为文件路径时先写入 dest + '.part', 完成后改名; 中断后再次下载, 以 HTTP Range 从断点继续(服务端支持时).
+
+        :param media_id: 素材id
+        :param dest: 文件路径(str 或 os.PathLike)或文件对象(有 write 方法)
+        :param chunk_size: 每次读写的字节数
+        :param resume: 是否从 .part 文件断点续传
+        :return: dict
+            {
+               "errcode": 0,
+               "errmsg": "ok",
+               "media_id": "MEDIA_ID",
+               "path": "dest",  // 文件路径(str), dest 为文件对象时为 None
+               "size": 1024,  // 本次写入的字节数
+               "content_type": "image/png",
+               "filename": "a.png"
+            }
+        """
+        if isinstance(dest, (str, bytes, os.PathLike)):
+            path = os.fsdecode(dest)
+        elif hasattr(dest, 'write'):
+            path = None
+        else:
+            raise TypeError('dest must be a path or a file object with write(), not {}'.format(type(dest).__name__))
+        offset = 0
+        header: dict = {}
+        if path is not None:
+            part = path + '.part'
+            if resume and os.path.exists(part):
+                offset = os.path.getsize(part)
+                header['Range'] = 'bytes={}-'.format(offset)
+
+        response = self._request(c.GET, c.GET_MEDIA, {'media_id': media_id}, add_header=header, stream=True)
+        size = 0
+        try:
+            if path is not None:
+                # 206 为从断点继续, 否则重新写
+                with open(part, 'ab' if response.status_code == 206 else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        size += f.write(chunk)
+                os.replace(part, path)
+            else:
+                for chunk in response.iter_content(chunk_size):
+                    dest.write(chunk)
+                    size += len(chunk)
+        except requests.RequestException as e:
+            # 读取中断, .part 保留供下次续传
+            raise exceptions.WorkRequestException('Download interrupted: {}'.format(e))
+        finally:
+            response.close()
+
+        filename = None
+        disposition = response.headers.get('Content-Disposition', '')
+        if 'filename=' in disposition:
+            filename = disposition.split('filename=', 1)[1].strip('"; ')
+        return {'errcode': 0, 'errmsg': 'ok', 'media_id': media_id, 'path': path, 'size': size,
+                'content_type': response.headers.get(c.CONTENT_TYPE), 'filename': filename}
+
+    def download_medias(self, items, max_workers: int = 4, **kwargs) -> dict:
+        """并发下载多个临时素材, 共用连接池
+
+        :param items: {media_id: dest} 或 [(media_id, dest), ...]
+        :param max_workers: 同时下载数, 不宜超过连接池大小
+        :param kwargs: 同 download_media
+        :return: {media_id: download_media 的结果 或 异常}
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        results: dict = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.download_media, media_id, dest, **kwargs): media_id for media_id, dest in items}
+            for future in futures:
+                try:
+                    results[futures[future]] = future.result()
+                except (exceptions.WorkException, exceptions.WorkRequestException, OSError) as e:
+                    results[futures[future]] = e
+        return results
+
     def create_menu(self, id: str, name: str):
 
         self._request(c.GET, c.DELETE_MENU)
@@ -494,7 +1026,19 @@ class Client(object):
 }}'''.format(key=id, name=name).encode('utf-8')
         return self._request(c.POST, c.CREATE_MENU, data=json_str)
 
-    def _request(self, method, request_path, params: dict = {}, add_path: dict = {}, add_header: dict = {}, data=None) -> dict:
+    def close(self):
+        """关闭连接池(外部传入的 transport 由调用方关闭)"""
+        if self._own_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _request(self, method, request_path, params: dict = {}, add_path: dict = {}, add_header: dict = {}, data=None,
+                 deadline: float = None, stream: bool = False) -> dict:
         """
         发送请求
 
@@ -502,54 +1046,94 @@ class Client(object):
         :param request_path: 请求路径
         :type request_path: dict
         :param params: 请求参数
+        :param deadline: 本次调用的总时限(秒), 默认使用连接池的设置
+        :param stream: 为 True 且返回的不是 json 时, 返回未读取内容的 requests.Response, 由调用方读取并关闭
         :return: result of dict
         """
-        # url 中增加 access_token 参数
-        if len(self.access_token) > 0:
-            request_path += f'?access_token={self.access_token}&agentid={self.agent_id}'
-        for k, v in add_path.items():
-            request_path += '&{}={}'.format(k, v)
-        if method == c.GET:
-            if len(self.access_token) > 0:
-                request_path += '&' + utils.parse_params_to_str(params)[1:]  # 用&替换掉?
-            else:
-                request_path = request_path + utils.parse_params_to_str(params)
-        # url
-        url = c.API_URL + request_path
+        policy, breaker = self.retry_policy, self.circuit_breaker
+        # 流式的请求体(如上传文件)读过后无法重放
+        replayable = data is None or isinstance(data, (bytes, str))
+        attempt, replayed = 0, False
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(request_path, corpid=self.corp_id)
+            if breaker is not None:
+                breaker.before(request_path)
+            token = self.access_token
+            try:
+                result = self._attempt(method, request_path, params, add_path, add_header, data, deadline, stream)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # 取消、KeyboardInterrupt 等: 不计为接口失败, 但不能让探测状态一直保留
+                    if breaker is not None:
+                        breaker.release(request_path)
+                    raise
+                if breaker is not None:
+                    breaker.record(request_path, e)
+                if not replayable or not isinstance(e, (exceptions.WorkException, exceptions.WorkRequestException)):
+                    raise
+                if not replayed and policy.is_token_error(e):
+                    # token 被其他进程刷新或提前失效: 刷新后立即重放一次
+                    replayed = True
+                    self.tokens.get(stale=token)
+                elif policy.should_retry(e, method, attempt):
+                    time.sleep(policy.delay(attempt))
+                    attempt += 1
+                else:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.retry(request_path)
+                continue
+            if breaker is not None:
+                breaker.record(request_path)
+            return result
 
-        timestamp = utils.get_timestamp()
+    def _attempt(self, method, request_path, params, add_path, add_header, data, deadline, stream):
+        """发送一次请求"""
+        if self.metrics is None:
+            return self._send(method, request_path, params, add_path, add_header, data, deadline, stream)
+        with self.metrics.track(request_path, method) as info:
+            return self._send(method, request_path, params, add_path, add_header, data, deadline, stream, info)
 
-        body = json.dumps(params, ensure_ascii=False).encode('utf-8') if method == c.POST else ""
+    def _send(self, method, request_path, params, add_path, add_header, data, deadline, stream, info=None):
+        request_path = self._build_path(method, request_path, params, add_path)
 
         # header = utils.get_header(timestamp)
         # # 两个dict相连, 后面覆盖前面
         # header = {**header, **add_header}
         header = add_header
 
-        # send request
-        response = None
-        # print("url:", url)
-        # print("headers:", header)
-        # print("body:", body)
-        if method == c.GET:
-            response = requests.get(url, headers=header)
-        elif method == c.POST:
-            if data is None:
-                response = requests.post(url, data=body, headers=header)
-            else:
-                response = requests.post(url, headers=header, data=data)
-            # response = requests.post(url, json=body, headers=header)
-        elif method == c.DELETE:
-            response = requests.delete(url, headers=header)
-
-        # exception handle
-        if not str(response.status_code).startswith('2'):
-            raise exceptions.WorkException(response)
+        # send request, 经连接池复用长连接
+        if method == c.POST and data is None:
+            data = self.serializer.dumps(params)
+        if info is not None:
+            info.bytes_out = body_size(data) if method == c.POST else 0
+        response = self.transport.request(method, request_path, headers=header, data=data if method == c.POST else None,
+                                          deadline=deadline, stream=stream)
+        if stream and str(response.status_code).startswith('2') \
+                and not response.headers.get(c.CONTENT_TYPE, '').startswith(c.APPLICATION_JSON):
+            if info is not None:
+                info.bytes_in = int(response.headers.get('Content-Length') or 0)
+            return response
+
+        if info is not None:
+            info.bytes_in = len(response.content)
+        return self._parse_response(response, self.serializer.loads)
+
+    @staticmethod
+    def _parse_response(response, loads=None) -> dict:
+        """检查返回结果, errcode 非 0 时抛出 WorkException
+
+        :param loads: 解析 json 的函数, 默认 response.json()
+        """
+        ok = str(response.status_code).startswith('2')
         try:
-            res_header = response.headers
-            rtn = response.json()
-            if rtn['errcode'] == 0:
-                return rtn
-            raise exceptions.WorkException(response)
+            rtn = loads(response.content) if loads is not None else response.json()
         except ValueError:
+            if not ok:
+                raise exceptions.WorkException(response)
             raise exceptions.WorkRequestException('Invalid Response: {}'.format(response.text))
+        # 已解析的结果传给 WorkException, 不再重复解析
+        if ok and rtn['errcode'] == 0:
+            return rtn
+        raise exceptions.WorkException(response, rtn)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(object):
+    __slots__ = ('message', 'count', 'first', 'last')
+
+    def __init__(self, message: dict, now: float):
+        self.message: dict = message
+        self.count: int = 1
+        self.first: float = now
+        self.last: float = now
+
+
+class Coalescer(object):
+    """合并重复消息(告警风暴)
+
+    以 (接收人, msgtype, content) 为指纹: 窗口内首次出现立即发送, 之后的重复只计数,
+    窗口结束时把重复合并为一条, 注明次数及首次/末次时间.
+    最多保留 max_entries 个指纹, 超出时提前结束最早的窗口.
+
+    Examples
+    --------
+    >>> coalescer = Coalescer(client, window=60).start()
+    >>> coalescer.send_text_toparty('2', 'db timeout')
+    """
+
+    SUMMARY = '[{count}次 {first} ~ {last}]\n{content}'
+    '''合并后的消息格式'''
+    SEPARATE = '重复的{msgtype}消息'
+    '''无法改写内容的消息(如 image, file, 预先编码的内容)另发一条文本摘要, 此为其内容'''
+
+    def __init__(self, client=None, window: float = 60, flush_interval: float = 5, max_entries: int = 100000,
+                 send=None, time_format: str = '%m-%d %H:%M:%S'):
+        """
+        :param client: Client, 用其 send_msg 发送
+        :param window: 合并窗口(秒)
+        :param flush_interval: 后台检查窗口结束的间隔(秒)
+        :param max_entries: 最多保留的指纹数
+        :param send: 发送函数, 参数同 send_msg, 默认 client.send_msg; 也可为 MessageQueue.put
+        :param time_format: 首次/末次时间的格式
+        """
+        self.send = send or client.send_msg
+        self.window: float = window
+        self.flush_interval: float = flush_interval
+        self.max_entries: int = max_entries
+        self.time_format: str = time_format
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+        self.stats: dict = {'sent': 0, 'failed': 0, 'folded': 0, 'summaries': 0, 'summary_failed': 0}
+
+    @staticmethod
+    def fingerprint(touser='', toparty='', totag='', msgtype: str = 'text', content: dict = {}) -> bytes:
+        def ids(v):
+            if not isinstance(v, (list, tuple, set, frozenset)):
+                v = str(v).split('|')
+            return sorted(str(id) for id in v if id != '')
+
+        # ContentTemplate 等预先编码的内容(bytes)直接参与摘要
+        raw = content if isinstance(content, bytes) else b''
+        key = json.dumps([ids(touser), ids(toparty), ids(totag), msgtype, None if raw else content],
+                         sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(key.encode('utf-8') + raw, digest_size=16).digest()
+
+    def send_msg(self, touser='', toparty='', totag='', msgtype: str = 'text', content: dict = {}) -> bool:
+        """
+        发送消息, 参数同 Client.send_msg
+
+        :return: True 为已发送, False 为重复消息已合并
+        """
+        message = {'touser': touser, 'toparty': toparty, 'totag': totag, 'msgtype': msgtype, 'content': content}
+        key = self.fingerprint(**message)
+        now = time.time()
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.first < self.window:
+                entry.count += 1
+                entry.last = now
+                self.stats['folded'] += 1
+                return False
+            if entry is not None:
+                evicted.append(self._entries.pop(key))
+            entry = self._entries[key] = _Entry(message, now)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        self._summarize(evicted)
+        try:
+            self.send(**message)
+        except BaseException:
+            # 首条发送失败: 不保留指纹, 之后的重复照常发送, 而不是被合并到一条没有发出的消息
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                self.stats['failed'] += 1
+            raise
+        with self._lock:
+            self.stats['sent'] += 1
+        return True
+
+    def send_text_touser(self, touser, msg: str) -> bool:
+        return self.send_msg(touser=touser, msgtype='text', content={'content': msg})
+
+    def send_text_toparty(self, toparty, msg: str) -> bool:
+        return self.send_msg(toparty=toparty, msgtype='text', content={'content': msg})
+
+    def send_text_totag(self, totag, msg: str) -> bool:
+        return self.send_msg(totag=totag, msgtype='text', content={'content': msg})
+
+    def flush(self, force: bool = False):
+        """
+        结束已到期的窗口, 发送合并后的消息
+
+        :param force: 结束全部窗口
+        """
+        now = time.time()
+        expired = []
+        with self._lock:
+            # 按首次出现的先后排列, 遇到未到期的即可停止
+            while self._entries:
+                key, entry = next(iter(self._entries.items()))
+                if not force and now - entry.first < self.window:
+                    break
+                del self._entries[key]
+                expired.append(entry)
+        self._summarize(expired)
+
+    def _summarize(self, entries: list):
+        for entry in entries:
+            if entry.count < 2:
+                continue
+            message = self._summary(entry)
+            try:
+                self.send(**message)
+            except Exception:
+                logger.exception('failed to send coalesced summary (%s repeats)', entry.count)
+                with self._lock:
+                    self.stats['summary_failed'] += 1
+                continue
+            with self._lock:
+                self.stats['summaries'] += 1
+
+    def _summary(self, entry: _Entry) -> dict:
+        """合并后的消息: text/markdown 改写 content, textcard 改写 description, news 改写第一篇的 description;
+        其他类型另发一条文本摘要"""
+        message = dict(entry.message)
+        msgtype, content = message['msgtype'], message['content']
+
+        def summary(text):
+            return self.SUMMARY.format(count=entry.count, content=text,
+                                       first=time.strftime(self.time_format, time.localtime(entry.first)),
+                                       last=time.strftime(self.time_format, time.localtime(entry.last)))
+
+        if isinstance(content, dict):
+            if msgtype in ('text', 'markdown'):
+                message['content'] = {**content, 'content': summary(content.get('content', ''))}
+                return message
+            if msgtype == 'textcard':
+                message['content'] = {**content, 'description': summary(content.get('description', ''))}
+                return message
+            if msgtype == 'news' and content.get('articles'):
+                articles = list(content['articles'])
+                articles[0] = {**articles[0], 'description': summary(articles[0].get('description', ''))}
+                message['content'] = {**content, 'articles': articles}
+                return message
+        message['msgtype'] = 'text'
+        message['content'] = {'content': summary(self.SEPARATE.format(msgtype=msgtype))}
+        return message
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """启动后台线程, 定时发送到期的合并消息"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='work_weixin-coalescer', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True):
+        """停止后台线程
+
+        :param flush: 发送尚未到期的合并消息
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush(force=True)
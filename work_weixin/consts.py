@@ -9,11 +9,15 @@ API_URL = 'https://qyapi.weixin.qq.com'
 GET_ACCESS_TOKEN = '/cgi-bin/gettoken'
 GET_DEPARTMENT = '/cgi-bin/department/list'
 GET_USER_LIST = '/cgi-bin/user/simplelist'
+GET_USER_LIST_ID = '/cgi-bin/user/list_id'
 SEND_MSG = '/cgi-bin/message/send'
 UPLOAD_TMP = '/cgi-bin/media/upload'
+GET_MEDIA = '/cgi-bin/media/get'
 UPLOAD_IMG = '/cgi-bin/media/uploadimg'
 CREATE_MENU = '/cgi-bin/menu/create'
 DELETE_MENU = '/cgi-bin/menu/delete'
+WEBHOOK_SEND = '/cgi-bin/webhook/send'
+WEBHOOK_UPLOAD = '/cgi-bin/webhook/upload_media'
 
 CONTENT_TYPE = 'Content-Type'
 CONTENT_LENGTH = 'Content-Length'
@@ -27,4 +31,10 @@ LOCALE = 'Locale='
 APPLICATION_JSON = 'application/json'
 
 GET = "GET"
-POST = "POST"
\ No newline at end of file
+POST = "POST"
+# send_msg 单次请求的接收人上限
+MAX_TOUSER = 1000
+MAX_TOPARTY = 100
+MAX_TOTAG = 100
+# send_msg 的接收人均无效
+ERR_ALL_INVALID_RECIPIENTS = 81013
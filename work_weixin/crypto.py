@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # pragma: no cover
+    Cipher = None
+
+from . import exceptions
+
+BLOCK_SIZE = 32
+'''企业微信的 PKCS#7 补位按32字节'''
+
+REPLY = '<xml><Encrypt><![CDATA[{encrypt}]]></Encrypt><MsgSignature><![CDATA[{signature}]]></MsgSignature>' \
+        '<TimeStamp>{timestamp}</TimeStamp><Nonce><![CDATA[{nonce}]]></Nonce></xml>'
+
+
+class WXBizMsgCrypt(object):
+    """回调消息的签名校验及加解密(AES-256-CBC)
+
+    明文格式: random(16字节) + msg_len(4字节, 网络字节序) + msg + receiveid
+    """
+
+    def __init__(self, token: str, encoding_aes_key: str, receive_id: str, max_age: float = 300):
+        """
+        :param token: 回调配置中的 Token
+        :param encoding_aes_key: 回调配置中的 EncodingAESKey(43位)
+        :param receive_id: 企业应用为 corpid
+        :param max_age: timestamp 与本机时间相差超过该秒数时拒绝, 防止截获的请求被重放; None 为不检查
+        """
+        if Cipher is None:
+            raise ImportError('WXBizMsgCrypt requires cryptography: pip install cryptography')
+        self.token: str = token
+        self.receive_id: str = receive_id
+        self.max_age: float = max_age
+        try:
+            self.key: bytes = base64.b64decode(encoding_aes_key + '=')
+        except ValueError:
+            raise exceptions.WorkCallbackException('Invalid EncodingAESKey')
+        if len(self.key) != 32:
+            raise exceptions.WorkCallbackException('Invalid EncodingAESKey')
+
+    def signature(self, timestamp, nonce, encrypt: str) -> str:
+        items = sorted([self.token, str(timestamp), str(nonce), encrypt])
+        return hashlib.sha1(''.join(items).encode('utf-8')).hexdigest()
+
+    def _cipher(self):
+        return Cipher(algorithms.AES(self.key), modes.CBC(self.key[:16]))
+
+    def encrypt(self, text: str) -> str:
+        msg = text.encode('utf-8')
+        plain = os.urandom(16) + struct.pack('I', socket.htonl(len(msg))) + msg + self.receive_id.encode('utf-8')
+        pad = BLOCK_SIZE - len(plain) % BLOCK_SIZE
+        plain += bytes([pad]) * pad
+        encryptor = self._cipher().encryptor()
+        return base64.b64encode(encryptor.update(plain) + encryptor.finalize()).decode('ascii')
+
+    def decrypt(self, encrypt: str) -> str:
+        try:
+            decryptor = self._cipher().decryptor()
+            plain = decryptor.update(base64.b64decode(encrypt)) + decryptor.finalize()
+            pad = plain[-1]
+            if pad < 1 or pad > BLOCK_SIZE:
+                raise ValueError('bad padding')
+            plain = plain[16:-pad]
+            msg_len = socket.ntohl(struct.unpack('I', plain[:4])[0])
+            msg, receive_id = plain[4:4 + msg_len], plain[4 + msg_len:]
+            if receive_id.decode('utf-8', 'replace') != self.receive_id:
+                raise exceptions.WorkCallbackException('ReceiveId mismatch')
+            # 含 UnicodeDecodeError
+            return msg.decode('utf-8')
+        except (ValueError, IndexError, struct.error) as e:
+            raise exceptions.WorkCallbackException('Decrypt failed: {}'.format(e))
+
+    def _check(self, msg_signature: str, timestamp, nonce, encrypt: str):
+        if not hmac.compare_digest(self.signature(timestamp, nonce, encrypt), str(msg_signature)):
+            raise exceptions.WorkCallbackException('Signature mismatch')
+        if self.max_age is not None:
+            try:
+                age = abs(time.time() - int(timestamp))
+            except (TypeError, ValueError):
+                raise exceptions.WorkCallbackException('Invalid timestamp')
+            if age > self.max_age:
+                raise exceptions.WorkCallbackException('Timestamp expired')
+
+    def verify_url(self, msg_signature: str, timestamp, nonce, echostr: str) -> str:
+        """验证回调URL(GET), 返回应原样回复的 echostr 明文"""
+        self._check(msg_signature, timestamp, nonce, echostr)
+        return self.decrypt(echostr)
+
+    def decrypt_msg(self, post_data, msg_signature: str, timestamp, nonce) -> str:
+        """解密推送的消息(POST), 返回明文xml"""
+        try:
+            encrypt = ET.fromstring(post_data).findtext('Encrypt')
+        except ET.ParseError as e:
+            raise exceptions.WorkCallbackException('Invalid xml: {}'.format(e))
+        if not encrypt:
+            raise exceptions.WorkCallbackException('Encrypt not found')
+        self._check(msg_signature, timestamp, nonce, encrypt)
+        return self.decrypt(encrypt)
+
+    def encrypt_msg(self, reply: str, nonce, timestamp=None) -> str:
+        """加密被动回复的消息, 返回密文xml"""
+        timestamp = str(timestamp or int(time.time()))
+        encrypt = self.encrypt(reply)
+        return REPLY.format(encrypt=encrypt, signature=self.signature(timestamp, nonce, encrypt),
+                            timestamp=timestamp, nonce=nonce)
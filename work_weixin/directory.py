@@ -0,0 +1,262 @@
+import sys
+import threading
+import time
+
+from .snapshot import DirectorySnapshot
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Department(object):
+    """部门"""
+
+    __slots__ = ('id', 'name', 'parentid', 'order', 'extra')
+    FIELDS = ('id', 'name', 'parentid', 'order')
+
+    def __init__(self, part: dict):
+        self.id: int = part['id']
+        self.name: str = _intern(part.get('name'))
+        self.parentid: int = part.get('parentid')
+        self.order: int = part.get('order')
+        # 其他字段(如 name_en), 大多数部门没有
+        extra = {_intern(k): v for k, v in part.items() if k not in self.FIELDS}
+        self.extra: dict = extra or None
+
+    def to_dict(self) -> dict:
+        part = {'id': self.id, 'name': self.name, 'parentid': self.parentid, 'order': self.order}
+        if self.extra:
+            part.update(self.extra)
+        return part
+
+    def __repr__(self):
+        return 'Department({}, {!r})'.format(self.id, self.name)
+
+
+class User(object):
+    """司员"""
+
+    __slots__ = ('userid', 'name', 'department', 'extra')
+    FIELDS = ('userid', 'name', 'department')
+
+    def __init__(self, user: dict):
+        self.userid: str = _intern(user['userid'])
+        self.name: str = _intern(user.get('name'))
+        self.department: tuple = tuple(user.get('department') or ())
+        extra = {_intern(k): v for k, v in user.items() if k not in self.FIELDS}
+        self.extra: dict = extra or None
+
+    def to_dict(self) -> dict:
+        user = {'userid': self.userid, 'name': self.name, 'department': list(self.department)}
+        if self.extra:
+            user.update(self.extra)
+        return user
+
+    def __repr__(self):
+        return 'User({!r}, {!r})'.format(self.userid, self.name)
+
+
+class Directory(object):
+    """部门及司员, 建立索引后子树及成员查询与结果大小成正比
+
+    Examples
+    --------
+    >>> client.directory.members(3, recursive=True)  # 部门3及其下所有部门的司员
+    >>> client.directory.find_users('张三')
+    """
+
+    def __init__(self, departments=(), users=()):
+        """
+        :param departments: 部门 dict 的列表(或 {id: dict})
+        :param users: 司员 dict 的列表(或 {userid: dict})
+        """
+        if hasattr(departments, 'values'):
+            departments = departments.values()
+        if hasattr(users, 'values'):
+            users = users.values()
+        self.department_records: dict = {}
+        '''{id: Department}'''
+        for part in departments:
+            record = Department(part)
+            self.department_records[record.id] = record
+        self.user_records: dict = {}
+        '''{userid: User}'''
+        for user in users:
+            record = User(user)
+            self.user_records[record.userid] = record
+
+        # parent -> children
+        children: dict = {}
+        for record in self.department_records.values():
+            children.setdefault(record.parentid, []).append(record.id)
+        self._children: dict = {id: tuple(ids) for id, ids in children.items()}
+
+        # dept -> 子树(含自身)
+        self._subtree: dict = {}
+        roots = [id for id, record in self.department_records.items() if record.parentid not in self.department_records]
+        for root in roots:
+            self._build_subtree(root)
+
+        # dept -> members, name -> userids
+        members: dict = {}
+        names: dict = {}
+        for record in self.user_records.values():
+            for id in record.department:
+                members.setdefault(id, []).append(record.userid)
+            names.setdefault(record.name, []).append(record.userid)
+        self._members: dict = {id: tuple(ids) for id, ids in members.items()}
+        self._names: dict = {name: tuple(ids) for name, ids in names.items()}
+
+        self._departments: dict = None
+        self._users: dict = None
+
+    @property
+    def departments(self) -> dict:
+        """兼容原来的 {id: department dict}, 首次访问时生成并缓存; 修改不影响索引"""
+        if self._departments is None:
+            self._departments = {id: record.to_dict() for id, record in self.department_records.items()}
+        return self._departments
+
+    @property
+    def users(self) -> dict:
+        """兼容原来的 {userid: user dict}, 首次访问时生成并缓存; 修改不影响索引"""
+        if self._users is None:
+            self._users = {userid: record.to_dict() for userid, record in self.user_records.items()}
+        return self._users
+
+    def _build_subtree(self, root: int):
+        # 迭代后序遍历, 避免部门层级很深时递归过深
+        stack = [(root, False)]
+        while stack:
+            id, visited = stack.pop()
+            if id in self._subtree:
+                continue
+            if visited:
+                subtree = {id}
+                for child in self._children.get(id, ()):
+                    subtree |= self._subtree[child]
+                self._subtree[id] = frozenset(subtree)
+            else:
+                stack.append((id, True))
+                stack.extend((child, False) for child in self._children.get(id, ()) if child not in self._subtree)
+
+    def department(self, id: int) -> Department:
+        return self.department_records[id]
+
+    def user(self, userid: str) -> User:
+        return self.user_records[userid]
+
+    def children(self, id: int) -> tuple:
+        """直属子部门id"""
+        return self._children.get(id, ())
+
+    def subtree(self, id: int) -> frozenset:
+        """部门及其下所有部门的id"""
+        return self._subtree.get(id, frozenset())
+
+    def members(self, id: int, recursive: bool = False) -> list:
+        """
+        部门的司员
+
+        :param recursive: 包含其下所有部门的司员
+        :return: userid 列表
+        """
+        if not recursive:
+            return list(self._members.get(id, ()))
+        seen = set()
+        result = []
+        for dept in self.subtree(id):
+            for userid in self._members.get(dept, ()):
+                if userid not in seen:
+                    seen.add(userid)
+                    result.append(userid)
+        return result
+
+    def user_departments(self, userid: str) -> tuple:
+        """司员所在部门id"""
+        record = self.user_records.get(userid)
+        return record.department if record is not None else ()
+
+    def find_users(self, name: str) -> list:
+        """按姓名查 userid, 同名时返回多个"""
+        return list(self._names.get(name, ()))
+
+    def __len__(self):
+        return len(self.user_records)
+
+
+class DirectoryCache(object):
+    """按需加载的 Directory, 可由同一企业的多个 Client 共用
+
+    首次访问时加载; 配置了快照时优先读快照, 超过有效期后在后台重新加载并替换.
+    """
+
+    def __init__(self, load, snapshot: DirectorySnapshot = None, enabled: bool = True):
+        """
+        :param load: 从接口加载的函数, 返回 (departments, users)
+        :param snapshot: 本地快照, 也可传入文件路径
+        :param enabled: False 时不加载, 始终为空
+        """
+        self.load = load
+        self.snapshot: DirectorySnapshot = DirectorySnapshot(snapshot) if isinstance(snapshot, str) else snapshot
+        self.enabled: bool = enabled
+        self._directory: Directory = None
+        self._loaded_at: float = 0
+        self._lock = threading.Lock()
+        self._flag_lock = threading.Lock()
+        self._refreshing: bool = False
+        self._listeners: list = []
+
+    def add_listener(self, callback):
+        """从接口重新加载后调用 callback(directory), 重复添加只调用一次"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def get(self) -> Directory:
+        if self._directory is not None:
+            if self.snapshot is not None and not self.snapshot.is_fresh(self._loaded_at):
+                self.refresh()
+            return self._directory
+        with self._lock:
+            if self._directory is not None:
+                return self._directory
+            if not self.enabled:
+                self._directory = Directory()
+                return self._directory
+            if self.snapshot is not None:
+                rec = self.snapshot.load()
+                if rec is not None:
+                    self._directory, self._loaded_at = Directory(rec[0], rec[1]), rec[2]
+                    if not self.snapshot.is_fresh(self._loaded_at):
+                        self.refresh()
+                    return self._directory
+            return self.reload()
+
+    def reload(self) -> Directory:
+        """从接口重新加载, 配置了快照时写入快照"""
+        departments, users = self.load()
+        self._directory, self._loaded_at = Directory(departments, users), time.time()
+        if self.snapshot is not None:
+            self.snapshot.save(departments, users, self._loaded_at)
+        for callback in self._listeners:
+            callback(self._directory)
+        return self._directory
+
+    def refresh(self):
+        """在后台重新加载, 完成后替换; 加载期间继续使用原数据"""
+        with self._flag_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.reload()
+        except Exception:
+            # 1分钟后再试
+            if self.snapshot is not None:
+                self._loaded_at = time.time() - self.snapshot.ttl + 60
+        finally:
+            self._refreshing = False
@@ -5,26 +5,40 @@
 # @Time    : 2018/11/24
 # @desc    : 异常类
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class WorkException(Exception):
 
-    def __init__(self, response):
-        print(response.text + ', ' + str(response.status_code))
+    def __init__(self, response, result: dict = None):
+        """
+        :param response: requests.Response / aiohttp.ClientResponse, 也可直接传入已解析的返回结果 dict
+        :param result: 已解析的返回结果, 避免重复解析
+        """
+        if isinstance(response, dict):
+            response, result = None, response
+        if response is not None and hasattr(response, 'text') and not callable(response.text):
+            logger.debug('%s, %s', response.text, response.status_code)
         self.code = 0
-        try:
-            json_res = response.json()
-        except ValueError:
-            self.message = 'Invalid JSON error message from Okex: {}'.format(response.text)
-        else:
-            if "errcode" in json_res.keys() and "errmsg" in json_res.keys():
-                self.code = json_res['errcode']
-                self.message = json_res['errmsg']
+        if result is None:
+            try:
+                result = response.json()
+            except ValueError:
+                result = None
+                self.message = 'Invalid JSON error message from Okex: {}'.format(response.text)
+        if result is not None:
+            if "errcode" in result.keys() and "errmsg" in result.keys():
+                self.code = result['errcode']
+                self.message = result['errmsg']
             else:
                 self.code = 'None'
                 self.message = 'Server error'
 
-        self.status_code = response.status_code
+        self.status_code = getattr(response, 'status_code', getattr(response, 'status', None))
         self.response = response
+        self.result = result
         self.request = getattr(response, 'request', None)
 
     def __str__(self):  # pragma: no cover
@@ -37,3 +51,20 @@ class WorkRequestException(Exception):
 
     def __str__(self):
         return 'WorkRequestException: {}'.format(self.message)
+
+
+class WorkCallbackException(Exception):
+    """回调消息校验签名或加解密失败"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return 'WorkCallbackException: {}'.format(self.message)
+
+
+class WorkCircuitOpenException(WorkRequestException):
+    """接口熔断中, 未发送请求"""
+
+    def __str__(self):
+        return 'WorkCircuitOpenException: {}'.format(self.message)
@@ -0,0 +1,134 @@
+import threading
+import time
+
+KINDS = ('user', 'party', 'tag')
+'''touser, toparty, totag 对应的类型'''
+
+
+class InvalidRecipientCache(object):
+    """无效接收人的缓存
+
+    记录 send_msg 返回的 invaliduser/invalidparty/invalidtag, 有效期内发送前即从接收人中去掉,
+    不再为离职成员、无权限的部门等组装及发送请求. 接收人是否有效取决于应用的可见范围, 按 scope(Client 为 (corpid, agentid))分别记录, 可由多个 Client 共用;
+    部门及司员刷新后, 重新出现的成员及部门从加载通讯录的应用的记录中移除.
+    userid 不区分大小写(接口返回的 invaliduser 为小写).
+
+    Examples
+    --------
+    >>> cache = InvalidRecipientCache(ttl=24 * 3600)
+    >>> client = Client(corpid, secret, agentid, invalid_cache=cache)
+    >>> other = Client(corpid, secret2, agentid2, invalid_cache=cache)  # 两个应用分别记录
+    >>> cache.stats  # hits 为去掉的接收人数, saved_bytes 为少发的请求体字节数
+    """
+
+    def __init__(self, ttl: float = 24 * 3600, max_entries: int = 100000):
+        """
+        :param ttl: 有效期(秒), 过期后再次尝试发送
+        :param max_entries: 最多缓存的接收人数, 超出时先清理过期的, 再清理最早记录的
+        """
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self._items: dict = {}
+        '''{(scope, kind, id): 过期时间}, 按记录的先后排列; userid 为小写'''
+        self._lock = threading.Lock()
+        self.stats: dict = {'hits': 0, 'saved_bytes': 0, 'skipped_requests': 0, 'recorded': 0, 'revalidated': 0}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: tuple):
+        expires_at = self._items.get(key)
+        return expires_at is not None and expires_at > time.time()
+
+    def record(self, result: dict, scope=None):
+        """记录 send_msg 返回结果中的无效接收人"""
+        self.add(scope=scope, **{kind: result.get('invalid' + kind, '') for kind in KINDS})
+
+    def add(self, user='', party='', tag='', scope=None):
+        """
+        记录无效接收人
+
+        :param user: "|" 连接的 userid 或 list, party/tag 同
+        :param scope: 所属的应用, 如 (corpid, agentid)
+        """
+        keys = [(scope, kind, _key(kind, id)) for kind, ids in zip(KINDS, (user, party, tag)) for id in _ids(ids)]
+        if not keys:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+                self._items[key] = expires_at
+            self.stats['recorded'] += len(keys)
+            if len(self._items) > self.max_entries:
+                self._prune()
+
+    def _prune(self):
+        now = time.time()
+        self._items = {k: v for k, v in self._items.items() if v > now}
+        while len(self._items) > self.max_entries:
+            del self._items[next(iter(self._items))]
+
+    def filter(self, touser='', toparty='', totag='', scope=None) -> tuple:
+        """
+        去掉缓存中 scope 下的无效接收人
+
+        :return: (touser, toparty, totag, skipped), 前三项为 "|" 连接的字符串,
+            skipped 为去掉的 {'invaliduser': ..., 'invalidparty': ..., 'invalidtag': ...}
+        """
+        if not self._items or touser == '@all':
+            return touser, toparty, totag, None
+        now = time.time()
+        kept, skipped, hits, saved = [], {}, 0, 0
+        for kind, ids in zip(KINDS, (touser, toparty, totag)):
+            valid, invalid = [], []
+            for id in _ids(ids):
+                expires_at = self._items.get((scope, kind, _key(kind, id)))
+                if expires_at is not None and expires_at > now:
+                    invalid.append(id)
+                    hits += 1
+                    saved += len(id) + 1
+                else:
+                    valid.append(id)
+            kept.append('|'.join(valid))
+            skipped['invalid' + kind] = '|'.join(invalid)
+        if hits == 0:
+            return touser, toparty, totag, None
+        with self._lock:
+            self.stats['hits'] += hits
+            self.stats['saved_bytes'] += saved
+            if not any(kept):
+                self.stats['skipped_requests'] += 1
+        return kept[0], kept[1], kept[2], skipped
+
+    def revalidate(self, directory, scope=None):
+        """
+        部门及司员刷新后, 移除 scope 下其中存在的成员及部门
+
+        通讯录按加载它的应用的可见范围返回, 只能用于该应用的记录, 其他应用的记录不变.
+
+        :param directory: Directory
+        :param scope: 加载 directory 的应用, 如 (corpid, agentid)
+        """
+        users = {userid.lower() for userid in directory.user_records}
+        with self._lock:
+            active = [key for key in self._items if key[0] == scope and (
+                      (key[1] == 'user' and key[2] in users)
+                      or (key[1] == 'party' and key[2].isdigit() and int(key[2]) in directory.department_records))]
+            for key in active:
+                del self._items[key]
+            self.stats['revalidated'] += len(active)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def _key(kind: str, id: str) -> str:
+    return id.lower() if kind == 'user' else id
+
+
+def _ids(ids) -> list:
+    if not isinstance(ids, (list, tuple, set, frozenset)):
+        ids = str(ids).split('|')
+    return [str(id) for id in ids if id != '']
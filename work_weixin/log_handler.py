@@ -0,0 +1,170 @@
+import logging
+import queue
+import threading
+
+DROP_NEW = 'drop_new'
+'''队列满时丢弃新的记录'''
+DROP_OLD = 'drop_old'
+'''队列满时丢弃最早的记录'''
+BLOCK = 'block'
+'''队列满时等待至多 block_timeout 秒, 仍满则丢弃新的记录'''
+
+
+class WorkWeixinHandler(logging.Handler):
+    """把日志发送到企业微信的 logging.Handler, 不阻塞记录日志的线程
+
+    emit 只格式化并放入有界队列; 后台线程每 flush_interval 秒取出队列中的记录, 按 (级别, logger) 分组,
+    合并为不超过 max_bytes 字节的文本消息后发送. 企业微信不可用时队列满则按 overflow 丢弃, 发送失败只计数,
+    不影响应用.
+
+    Examples
+    --------
+    >>> handler = WorkWeixinHandler(client, toparty='2', level=logging.ERROR)
+    >>> handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    >>> logging.getLogger().addHandler(handler)
+    """
+
+    HEADER = '[{level}] {name} ({count}条)'
+    '''每条消息的标题'''
+
+    def __init__(self, client=None, touser='', toparty='', totag='', level=logging.ERROR, capacity: int = 1000,
+                 overflow: str = DROP_NEW, block_timeout: float = 0.1, flush_interval: float = 2,
+                 max_bytes: int = 2048, send=None):
+        """
+        :param client: Client, 用其 send_msg 发送
+        :param touser: 接收人, 同 send_msg, 如值班人员; toparty/totag 同
+        :param level: 发送的最低级别
+        :param capacity: 队列上限(条)
+        :param overflow: 队列满时的处理 DROP_NEW, DROP_OLD 或 BLOCK
+        :param block_timeout: overflow 为 BLOCK 时的最长等待(秒)
+        :param flush_interval: 合并发送的间隔(秒)
+        :param max_bytes: 单条消息内容的字节上限(text 为2048)
+        :param send: 发送函数, 参数同 send_msg, 默认 client.send_msg; 也可为 Coalescer.send_msg, MessageQueue.put
+        """
+        super().__init__(level)
+        if overflow not in (DROP_NEW, DROP_OLD, BLOCK):
+            raise ValueError('overflow must be one of {}, {}, {}'.format(DROP_NEW, DROP_OLD, BLOCK))
+        self.send = send or client.send_msg
+        self.touser, self.toparty, self.totag = touser, toparty, totag
+        self.overflow: str = overflow
+        self.block_timeout: float = block_timeout
+        self.flush_interval: float = flush_interval
+        self.max_bytes: int = max_bytes
+        self.stats: dict = {'queued': 0, 'dropped': 0, 'sent': 0, 'failed': 0}
+        '''queued/dropped 为日志条数, sent/failed 为消息数'''
+        self._queue: queue.Queue = queue.Queue(capacity)
+        self._dropped: int = 0
+        '''上次发送后丢弃的条数, 在下一条消息中注明'''
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='work_weixin-log-handler', daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        if threading.current_thread() is self._thread:
+            return  # 发送过程中产生的日志, 避免循环
+        try:
+            item = (record.levelname, record.name, self.format(record))
+        except Exception:
+            self.handleError(record)
+            return
+        if self._put(item):
+            self.stats['queued'] += 1
+        else:
+            self.stats['dropped'] += 1
+            self._dropped += 1
+
+    def _put(self, item: tuple) -> bool:
+        try:
+            if self.overflow == BLOCK:
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            if self.overflow != DROP_OLD:
+                return False
+        # 丢弃最早的一条后重试一次, 与后台线程并发取出时仍可能满
+        try:
+            self._queue.get_nowait()
+            self.stats['dropped'] += 1
+            self._dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def _drain(self) -> list:
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # 等待本轮间隔内的其他记录一起发送
+            self._stopped.wait(self.flush_interval)
+            self._send([first] + self._drain())
+
+    def _send(self, items: list):
+        groups: dict = {}
+        for level, name, text in items:
+            groups.setdefault((level, name), []).append(text)
+        dropped, self._dropped = self._dropped, 0
+        for (level, name), texts in groups.items():
+            header = self.HEADER.format(level=level, name=name, count=len(texts))
+            if dropped:
+                header += ' 队列已满, 丢弃{}条'.format(dropped)
+                dropped = 0
+            for content in self.pack(header, texts, self.max_bytes):
+                try:
+                    self.send(touser=self.touser, toparty=self.toparty, totag=self.totag, msgtype='text',
+                              content={'content': content})
+                    self.stats['sent'] += 1
+                except Exception:
+                    # 含熔断等异常, 发送失败不影响后台线程
+                    self.stats['failed'] += 1
+
+    @staticmethod
+    def pack(header: str, texts: list, max_bytes: int) -> list:
+        """
+        把多条日志合并为若干条消息, 每条以 header 开头, 按 utf-8 编码不超过 max_bytes 字节
+
+        单条日志超长时截断, 末尾为 ...
+        """
+        head = header.encode('utf-8')
+        messages, parts, size = [], [head], len(head)
+        for text in texts:
+            data = text.encode('utf-8')
+            limit = max_bytes - len(head) - 1
+            if len(data) > limit:
+                data = data[:limit - 3].decode('utf-8', 'ignore').encode('utf-8') + b'...'
+            if size + 1 + len(data) > max_bytes:
+                messages.append(b'\n'.join(parts).decode('utf-8'))
+                parts, size = [head], len(head)
+            parts.append(data)
+            size += 1 + len(data)
+        if len(parts) > 1:
+            messages.append(b'\n'.join(parts).decode('utf-8'))
+        return messages
+
+    def close(self, timeout: float = 5):
+        """停止后台线程, 并发送队列中剩余的记录
+
+        :param timeout: 等待后台线程的秒数
+        """
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._thread.join(timeout)
+            items = self._drain()
+            if items:
+                self._send(items)
+        super().close()
@@ -0,0 +1,95 @@
+import os
+import threading
+
+from .client import Client
+from .snapshot import DirectorySnapshot
+from .token import TokenStore, MemoryTokenStore, token_key
+from .transport import Transport
+
+
+class ClientManager(object):
+    """管理多个企业、多个应用的 Client
+
+    所有 Client 共用一个连接池; 同一 (corpid, secret) 共用一个 token;
+    同一企业共用一份部门及司员信息(及快照). 新增一个应用几乎没有额外开销.
+
+    Examples
+    --------
+    >>> manager = ClientManager(snapshot_dir='/var/cache/work_weixin')
+    >>> alert = manager.get(corpid, secret1, 1000002)
+    >>> report = manager.get(corpid, secret2, 1000003)
+    """
+
+    def __init__(self, transport: Transport = None, token_store: TokenStore = None, snapshot_dir: str = None,
+                 snapshot_ttl: float = 3600, load_directory: bool = True, **client_options):
+        """
+        :param transport: 共用的连接池, 为 None 时按 client_options 中的 pool_size/timeout/deadline 新建
+        :param token_store: token 存储, 默认为本管理器独有的内存存储
+        :param snapshot_dir: 部门及司员快照的目录, 每个企业一个文件; None 为不使用快照
+        :param snapshot_ttl: 快照有效期(秒)
+        :param load_directory: 是否加载部门及司员信息
+        :param client_options: 其他 Client 参数, 如 send_workers, rate_limiter, media_cache;
+            所有 Client 共用同一个 rate_limiter/media_cache, 二者按 corpid(限流还按 agentid)分别计算
+        """
+        if transport is None:
+            timeout = client_options.pop('timeout', (3.05, 10))
+            transport = Transport(pool_size=client_options.pop('pool_size', 10), connect_timeout=timeout[0],
+                                  read_timeout=timeout[1], deadline=client_options.pop('deadline', None),
+                                  preconnect=client_options.pop('preconnect', False))
+        self.transport: Transport = transport
+        self.token_store: TokenStore = token_store or MemoryTokenStore()
+        self.snapshot_dir: str = snapshot_dir
+        self.snapshot_ttl: float = snapshot_ttl
+        self.load_directory: bool = load_directory
+        self.client_options: dict = client_options
+        self._tokens: dict = {}
+        self._directories: dict = {}
+        self._clients: dict = {}
+        self._lock = threading.RLock()
+
+    def get(self, corpid: str, secret: str, agentid) -> Client:
+        """
+        取(或新建)应用的 Client
+
+        :param corpid: 企业ID
+        :param secret: 应用的安全码
+        :param agentid: 应用ID
+        """
+        key = (corpid, str(agentid))
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            # 该 (corpid, secret) / 企业的第一个 Client 新建 TokenManager / DirectoryCache, 之后的共用
+            tkey = token_key(corpid, secret)
+            client = Client(corpid, secret, agentid, transport=self.transport, token_store=self.token_store,
+                            load_directory=self.load_directory, snapshot=self._snapshot(corpid),
+                            tokens=self._tokens.get(tkey), directory=self._directories.get(corpid),
+                            **self.client_options)
+            self._tokens.setdefault(tkey, client.tokens)
+            self._directories.setdefault(corpid, client.directory_cache)
+            self._clients[key] = client
+            return client
+
+    def _snapshot(self, corpid: str):
+        if self.snapshot_dir is None:
+            return None
+        return DirectorySnapshot(os.path.join(self.snapshot_dir, '{}.jsonl'.format(corpid)), self.snapshot_ttl)
+
+    def clients(self) -> list:
+        """已创建的全部 Client"""
+        return list(self._clients.values())
+
+    def close(self):
+        """关闭共用的连接池"""
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+MEDIA_TTL = 3 * 24 * 3600
+'''临时素材 media_id 的有效期(3天)'''
+
+
+class MediaCache(object):
+    """按文件内容缓存临时素材的 media_id
+
+    键为 企业ID + 素材类型 + sha256(文件内容), 同样的文件在有效期内不再重复上传.
+    media_id 只能在上传的企业内使用, 多个企业的 Client 共用时分别缓存.
+    path 为 None 时只缓存在内存中.
+    """
+
+    def __init__(self, path: str = None, ttl: float = MEDIA_TTL, margin: float = 3600):
+        """
+        :param path: 缓存文件(JSON), None 为只缓存在内存
+        :param ttl: media_id 有效期(秒)
+        :param margin: 到期前 margin 秒起视为失效, 重新上传
+        """
+        self.path: str = path
+        self.ttl: float = ttl
+        self.margin: float = margin
+        self._lock = threading.Lock()
+        self._items: dict = {}
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._items = json.load(f)
+            except (OSError, ValueError):
+                self._items = {}
+        self.stats: dict = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def digest(file_name: str, chunk_size: int = 1 << 20) -> str:
+        """文件内容的 sha256, 分块读取"""
+        h = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @staticmethod
+    def _key(digest: str, type: str, corpid: str = None) -> str:
+        if corpid is None:
+            return '{}:{}'.format(type, digest)
+        return '{}:{}:{}'.format(corpid, type, digest)
+
+    def get(self, digest: str, type: str, corpid: str = None):
+        """
+        :param corpid: 上传素材的企业ID
+        :return: {'media_id': ..., 'created_at': ...}, 无缓存或将要过期时为 None
+        """
+        item = self._items.get(self._key(digest, type, corpid))
+        if item is not None and float(item['created_at']) + self.ttl - self.margin > time.time():
+            self.stats['hits'] += 1
+            return item
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, digest: str, type: str, media_id: str, created_at=None, corpid: str = None):
+        with self._lock:
+            self._items[self._key(digest, type, corpid)] = {'media_id': media_id, 'created_at': created_at or time.time()}
+            if self.path is not None:
+                self._save()
+
+    def _save(self):
+        now = time.time()
+        self._items = {k: v for k, v in self._items.items() if float(v['created_at']) + self.ttl > now}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.media')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._items, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+
+from . import exceptions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+'''耗时直方图的桶(秒)'''
+
+
+class RequestInfo(object):
+    """一次请求的度量信息, 传给 before/after 钩子
+
+    context 供钩子存放自己的数据, 如 before 中创建的 tracing span.
+    """
+
+    __slots__ = ('metrics', 'endpoint', 'method', 'started', 'elapsed', 'bytes_out', 'bytes_in', 'errcode', 'error',
+                 'context')
+
+    def __init__(self, metrics, endpoint: str, method: str):
+        self.metrics = metrics
+        self.endpoint: str = endpoint
+        self.method: str = method
+        self.started: float = time.perf_counter()
+        self.elapsed: float = None
+        self.bytes_out: int = 0
+        self.bytes_in: int = 0
+        self.errcode = None
+        '''0 为成功; 接口返回的 errcode; 网络错误等为 'request_error' '''
+        self.error: Exception = None
+        self.context: dict = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.finish(self, exc)
+
+
+class _Histogram(object):
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.counts: list = [0] * size
+        self.sum: float = 0
+        self.count: int = 0
+
+
+class Metrics(object):
+    """按接口统计请求的耗时、errcode、重试、流量及在途请求数
+
+    传给 Client(metrics=...) 后生效, 不传时请求路径上只多一次 None 判断.
+    多个 Client 可共用一个 Metrics.
+
+    Examples
+    --------
+    >>> metrics = Metrics()
+    >>> metrics.add_hook(before=lambda info: info.context.update(span=tracer.start_span(info.endpoint)),
+    ...                  after=lambda info: info.context['span'].finish())
+    >>> client = Client(corpid, secret, agentid, metrics=metrics)
+    >>> print(metrics.render())  # Prometheus 文本格式
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, prefix: str = 'work_weixin'):
+        """
+        :param buckets: 耗时直方图的桶(秒), 升序
+        :param prefix: 指标名前缀
+        """
+        self.buckets: tuple = tuple(sorted(buckets))
+        self.prefix: str = prefix
+        self._lock = threading.Lock()
+        self._latency: dict = {}
+        '''{endpoint: _Histogram}'''
+        self._requests: dict = {}
+        '''{(endpoint, errcode): count}'''
+        self._retries: dict = {}
+        self._bytes_out: dict = {}
+        self._bytes_in: dict = {}
+        self._in_flight: dict = {}
+        self._before: list = []
+        self._after: list = []
+
+    def add_hook(self, before=None, after=None):
+        """
+        添加请求前后的钩子, 参数均为 RequestInfo; 钩子抛出的异常只记录日志, 不影响请求
+
+        :param before: 发送请求前调用
+        :param after: 请求完成(成功或失败)后调用
+        """
+        if before is not None:
+            self._before.append(before)
+        if after is not None:
+            self._after.append(after)
+
+    def track(self, endpoint: str, method: str) -> RequestInfo:
+        """开始一次请求, 返回的 RequestInfo 可用作 with 语句, 退出时调用 finish"""
+        info = RequestInfo(self, endpoint, method)
+        with self._lock:
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        self._call_hooks(self._before, info)
+        return info
+
+    def finish(self, info: RequestInfo, error: Exception = None):
+        """结束一次请求, error 为请求抛出的异常"""
+        info.elapsed = time.perf_counter() - info.started
+        info.error = error
+        if error is None:
+            info.errcode = 0
+        elif isinstance(error, exceptions.WorkException):
+            info.errcode = error.code
+        else:
+            info.errcode = 'request_error'
+        endpoint = info.endpoint
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            hist = self._latency.get(endpoint)
+            if hist is None:
+                hist = self._latency[endpoint] = _Histogram(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if info.elapsed <= bound:
+                    hist.counts[i] += 1
+                    break
+            hist.sum += info.elapsed
+            hist.count += 1
+            key = (endpoint, str(info.errcode))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._bytes_out[endpoint] = self._bytes_out.get(endpoint, 0) + info.bytes_out
+            self._bytes_in[endpoint] = self._bytes_in.get(endpoint, 0) + info.bytes_in
+        self._call_hooks(self._after, info)
+
+    def retry(self, endpoint: str):
+        """记录一次重试"""
+        with self._lock:
+            self._retries[endpoint] = self._retries.get(endpoint, 0) + 1
+
+    @staticmethod
+    def _call_hooks(hooks: list, info: RequestInfo):
+        for hook in hooks:
+            try:
+                hook(info)
+            except Exception:
+                logger.exception('metrics hook %r failed', hook)
+
+    def snapshot(self) -> dict:
+        """当前各指标的副本"""
+        with self._lock:
+            return {
+                'latency': {k: {'buckets': dict(zip(self.buckets, v.counts)), 'sum': v.sum, 'count': v.count}
+                            for k, v in self._latency.items()},
+                'requests': dict(self._requests),
+                'retries': dict(self._retries),
+                'bytes_out': dict(self._bytes_out),
+                'bytes_in': dict(self._bytes_in),
+                'in_flight': dict(self._in_flight),
+            }
+
+    def render(self) -> str:
+        """Prometheus 文本格式(text/plain; version=0.0.4)"""
+        p = self.prefix
+        s = self.snapshot()
+        lines = ['# HELP {}_request_duration_seconds Request latency by endpoint.'.format(p),
+                 '# TYPE {}_request_duration_seconds histogram'.format(p)]
+        for endpoint, hist in sorted(s['latency'].items()):
+            label = 'endpoint="{}"'.format(_escape(endpoint))
+            cumulative = 0
+            for bound in self.buckets:
+                cumulative += hist['buckets'][bound]
+                lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(p, label, bound, cumulative))
+            lines.append('{}_request_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(p, label, hist['count']))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(p, label, hist['sum']))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(p, label, hist['count']))
+
+        lines += ['# HELP {}_requests_total Requests by endpoint and errcode.'.format(p),
+                  '# TYPE {}_requests_total counter'.format(p)]
+        for (endpoint, errcode), value in sorted(s['requests'].items()):
+            lines.append('{}_requests_total{{endpoint="{}",errcode="{}"}} {}'.format(
+                p, _escape(endpoint), _escape(errcode), value))
+
+        for name, key, help, type in (('retries_total', 'retries', 'Retried requests by endpoint.', 'counter'),
+                                      ('sent_bytes_total', 'bytes_out', 'Request body bytes by endpoint.', 'counter'),
+                                      ('received_bytes_total', 'bytes_in', 'Response body bytes by endpoint.',
+                                       'counter'),
+                                      ('in_flight_requests', 'in_flight', 'Requests in flight by endpoint.', 'gauge')):
+            lines += ['# HELP {}_{} {}'.format(p, name, help), '# TYPE {}_{} {}'.format(p, name, type)]
+            for endpoint, value in sorted(s[key].items()):
+                lines.append('{}_{}{{endpoint="{}"}} {}'.format(p, name, _escape(endpoint), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def body_size(data) -> int:
+    """请求体的字节数, 流式上传取 len 属性"""
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return getattr(data, 'len', 0) or 0
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+from . import consts as c
+
+
+class TokenBucket(object):
+    """令牌桶: 容量 capacity, 每秒补充 rate 个"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def reserve(self, n: float = 1, now: float = None) -> float:
+        """
+        预占 n 个令牌, 不足时记为欠额
+
+        :return: 需要等待的秒数, 0 为立即可用
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+DEFAULT_LIMITS = {
+    c.GET_ACCESS_TOKEN: (60, 60),
+    c.SEND_MSG: (10000, 60),
+    c.UPLOAD_TMP: (10000, 60),
+}
+'''各接口的默认上限 {path: (次数, 秒)}, 参考企业微信: 每企业调用单个接口不超过1万次/分'''
+
+
+class RateLimiter(object):
+    """按接口及接收人限流, 超出上限时等待而不是报错
+
+    接口额度按企业计算, 接收人额度按应用计算(对应企业微信的限制), 可由多个企业、多个应用的 Client 共用.
+
+    Examples
+    --------
+    >>> limiter = RateLimiter(limits={c.SEND_MSG: (600, 60)}, per_recipient=(30, 60))
+    >>> client = Client(corpid, secret, agentid, rate_limiter=limiter)
+    """
+
+    def __init__(self, limits: dict = None, default: tuple = (10000, 60), per_recipient: tuple = (30, 60),
+                 max_recipients: int = 100000):
+        """
+        :param limits: 各接口的上限 {path: (次数, 秒)}, 与 DEFAULT_LIMITS 合并
+        :param default: 未配置接口的上限, None 为不限
+        :param per_recipient: 每个接收人的上限(应用对同一成员不超过30次/分), None 为不限
+        :param max_recipients: 最多保留的接收人令牌桶数, 超出时清理已补满的桶
+        """
+        self.limits: dict = {**DEFAULT_LIMITS, **(limits or {})}
+        self.default: tuple = default
+        self.per_recipient: tuple = per_recipient
+        self.max_recipients: int = max_recipients
+        self._endpoints: dict = {}
+        self._recipients: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bucket(limit: tuple) -> TokenBucket:
+        count, period = limit
+        return TokenBucket(count / period, count)
+
+    def reserve(self, endpoint: str = None, recipients=(), corpid: str = None, agentid=None) -> float:
+        """
+        预占接口及各接收人的额度
+
+        :param endpoint: 接口路径, 如 c.SEND_MSG
+        :param recipients: 接收人 userid 列表
+        :param corpid: 企业ID, 各企业的接口额度分别计算
+        :param agentid: 应用ID, 各应用的接收人额度分别计算
+        :return: 需要等待的秒数
+        """
+        wait = 0
+        now = time.monotonic()
+        with self._lock:
+            if endpoint is not None:
+                key = (corpid, endpoint)
+                bucket = self._endpoints.get(key)
+                if bucket is None:
+                    limit = self.limits.get(endpoint, self.default)
+                    if limit is not None:
+                        bucket = self._endpoints[key] = self._bucket(limit)
+                if bucket is not None:
+                    wait = bucket.reserve(1, now)
+            if self.per_recipient is not None and recipients:
+                if len(self._recipients) > self.max_recipients:
+                    self._prune(now)
+                scope = (corpid, None if agentid is None else str(agentid))
+                for id in recipients:
+                    key = (scope, id)
+                    bucket = self._recipients.get(key)
+                    if bucket is None:
+                        bucket = self._recipients[key] = self._bucket(self.per_recipient)
+                    wait = max(wait, bucket.reserve(1, now))
+        return wait
+
+    def _prune(self, now: float):
+        for key in [key for key, bucket in self._recipients.items() if bucket.is_full(now)]:
+            del self._recipients[key]
+
+    def acquire(self, endpoint: str = None, recipients=(), corpid: str = None, agentid=None):
+        """阻塞到额度可用"""
+        wait = self.reserve(endpoint, recipients, corpid, agentid)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, endpoint: str = None, recipients=(), corpid: str = None, agentid=None):
+        """等待到额度可用, 不阻塞事件循环"""
+        wait = self.reserve(endpoint, recipients, corpid, agentid)
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+
+from . import consts as c, exceptions
+
+TOKEN_ERRCODES = frozenset({40014, 41001, 42001})
+'''access_token 无效/缺失/过期, 刷新 token 后重放'''
+
+TRANSIENT_ERRCODES = frozenset({-1, 45009, 45033})
+'''系统繁忙, 接口调用超过限制, 并发超过限制: 退避后重试'''
+
+
+class RetryPolicy(object):
+    """_request 的重试策略
+
+    token 失效时刷新 token 并重放一次; 系统繁忙、超过频率限制及 http 5xx 时按指数退避(全抖动)重试.
+    网络错误(超时、连接中断)时请求可能已被处理, 默认只重试 GET.
+    请求体为流(如上传文件)时无法重放, 不重试.
+
+    Examples
+    --------
+    >>> client = Client(corpid, secret, agentid, retry_policy=RetryPolicy(max_attempts=5, backoff=0.5))
+    >>> client = Client(corpid, secret, agentid, retry_policy=RetryPolicy.disabled())  # 不重试
+    """
+
+    def __init__(self, max_attempts: int = 3, backoff: float = 0.2, max_backoff: float = 5,
+                 replay_token: bool = True, retry_post_on_network_error: bool = False,
+                 token_errcodes=TOKEN_ERRCODES, transient_errcodes=TRANSIENT_ERRCODES):
+        """
+        :param max_attempts: 最多尝试次数(含第一次), 不含 token 重放
+        :param backoff: 第一次重试的退避上限(秒), 之后每次翻倍, 实际等待 [0, 上限) 随机
+        :param max_backoff: 退避上限的最大值(秒)
+        :param replay_token: token 失效时刷新并重放一次
+        :param retry_post_on_network_error: 网络错误时也重试 POST(可能重复发送)
+        :param token_errcodes: 视为 token 失效的 errcode
+        :param transient_errcodes: 可重试的 errcode
+        """
+        self.max_attempts: int = max_attempts
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.replay_token: bool = replay_token
+        self.retry_post_on_network_error: bool = retry_post_on_network_error
+        self.token_errcodes = frozenset(token_errcodes)
+        self.transient_errcodes = frozenset(transient_errcodes)
+
+    @classmethod
+    def disabled(cls):
+        """不重试, 也不重放 token"""
+        return cls(max_attempts=1, replay_token=False)
+
+    def is_token_error(self, error: Exception) -> bool:
+        return self.replay_token and isinstance(error, exceptions.WorkException) and error.code in self.token_errcodes
+
+    def is_transient(self, error: Exception) -> bool:
+        """接口繁忙或不可用(而不是参数等业务错误)"""
+        if isinstance(error, exceptions.WorkCircuitOpenException):
+            return False
+        if isinstance(error, exceptions.WorkException):
+            return error.code in self.transient_errcodes or (error.status_code or 0) >= 500
+        return isinstance(error, exceptions.WorkRequestException)
+
+    def should_retry(self, error: Exception, method: str, attempt: int) -> bool:
+        """
+        :param attempt: 已失败的次数减一(第一次失败为 0)
+        """
+        if attempt + 1 >= self.max_attempts or not self.is_transient(error):
+            return False
+        if isinstance(error, exceptions.WorkException):
+            return True
+        return method == c.GET or self.retry_post_on_network_error
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待(秒)"""
+        return random.random() * min(self.max_backoff, self.backoff * (2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """按接口熔断
+
+    连续 failure_threshold 次接口繁忙/不可用后熔断 reset_timeout 秒, 期间直接抛出 WorkCircuitOpenException,
+    不再占用线程等待; 之后放行一个探测请求, 成功则恢复, 失败则再熔断.
+    业务错误(如 userid 无效)说明接口可用, 不计为失败.
+
+    Examples
+    --------
+    >>> client = Client(corpid, secret, agentid, circuit_breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, policy: RetryPolicy = None):
+        """
+        :param failure_threshold: 连续失败多少次后熔断
+        :param reset_timeout: 熔断时长(秒)
+        :param policy: 用其 is_transient 判断是否计为失败, 默认 RetryPolicy()
+        """
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.policy: RetryPolicy = policy or RetryPolicy()
+        self._lock = threading.Lock()
+        self._circuits: dict = {}
+        '''{endpoint: [state, 连续失败次数, 熔断或开始探测的时间]}'''
+
+    def state(self, endpoint: str) -> str:
+        circuit = self._circuits.get(endpoint)
+        return circuit[0] if circuit is not None else self.CLOSED
+
+    def before(self, endpoint: str):
+        """请求前调用, 熔断中抛出 WorkCircuitOpenException"""
+        circuit = self._circuits.get(endpoint)
+        if circuit is None or circuit[0] == self.CLOSED:
+            return
+        with self._lock:
+            state, _, since = circuit
+            now = time.monotonic()
+            # 探测请求超过 reset_timeout 仍无结果(如被取消而未 record)时, 再放行一个
+            if state == self.CLOSED:
+                return
+            if now - since >= self.reset_timeout:
+                circuit[0], circuit[2] = self.HALF_OPEN, now  # 放行这一个探测请求
+                return
+            remaining = max(self.reset_timeout - (now - since), 0)
+        raise exceptions.WorkCircuitOpenException('{} circuit open, retry in {:.1f}s'.format(endpoint, remaining))
+
+    def release(self, endpoint: str):
+        """请求未完成(如被取消)时调用: 探测请求没有结果, 下一个请求立即再探测"""
+        circuit = self._circuits.get(endpoint)
+        if circuit is None or circuit[0] != self.HALF_OPEN:
+            return
+        with self._lock:
+            if circuit[0] == self.HALF_OPEN:
+                circuit[0], circuit[2] = self.OPEN, time.monotonic() - self.reset_timeout
+
+    def record(self, endpoint: str, error: Exception = None):
+        """请求后调用, error 为请求抛出的异常"""
+        failed = error is not None and self.policy.is_transient(error)
+        circuit = self._circuits.get(endpoint)
+        if not failed and (circuit is None or (circuit[0] == self.CLOSED and circuit[1] == 0)):
+            return
+        with self._lock:
+            circuit = self._circuits.setdefault(endpoint, [self.CLOSED, 0, 0])
+            if not failed:
+                circuit[0], circuit[1] = self.CLOSED, 0
+            elif circuit[0] == self.HALF_OPEN or circuit[1] + 1 >= self.failure_threshold:
+                circuit[0], circuit[1], circuit[2] = self.OPEN, circuit[1] + 1, time.monotonic()
+            else:
+                circuit[1] += 1
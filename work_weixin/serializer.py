@@ -0,0 +1,44 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONSerializer(object):
+    """标准库 json, 中文不转义, 输出紧凑的 utf-8 字节"""
+
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        """:param data: bytes 或 str"""
+        return json.loads(data)
+
+
+class OrjsonSerializer(object):
+    """orjson, 比标准库快数倍; 需 pip install orjson"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('OrjsonSerializer requires orjson: pip install orjson')
+
+    @staticmethod
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+def default_serializer():
+    """安装了 orjson 时用 orjson, 否则用标准库"""
+    return OrjsonSerializer() if orjson is not None else JSONSerializer()
@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import time
+
+VERSION = 1
+
+
+class DirectorySnapshot(object):
+    """部门及司员信息的本地快照(JSON-lines)
+
+    第一行为头 {"version": 1, "created_at": ...}, 其后每行一个部门 {"d": {...}} 或司员 {"u": {...}}.
+    写入先写临时文件再 os.replace, 读取方不会看到写了一半的文件.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600):
+        """
+        :param path: 快照文件
+        :param ttl: 有效期(秒), 过期后仍可使用, 但应在后台刷新
+        """
+        self.path: str = path
+        self.ttl: float = ttl
+
+    def is_fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl
+
+    def load(self):
+        """
+        读取快照
+
+        :return: (departments, users, created_at), 无快照或格式不符时为 None
+        """
+        departments: dict = {}
+        users: dict = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != VERSION:
+                    return None
+                for line in f:
+                    rec = json.loads(line)
+                    if 'd' in rec:
+                        departments[rec['d']['id']] = rec['d']
+                    else:
+                        users[rec['u']['userid']] = rec['u']
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+        return departments, users, header['created_at']
+
+    def save(self, departments: dict, users: dict, created_at: float = None):
+        """原子写入快照"""
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=dir_name, prefix='.snapshot')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+                f.write(dumps({'version': VERSION, 'created_at': created_at or time.time()}) + '\n')
+                for part in departments.values():
+                    f.write(dumps({'d': part}) + '\n')
+                for user in users.values():
+                    f.write(dumps({'u': user}) + '\n')
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -0,0 +1,228 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+'''告警等需要立即送达的消息'''
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+'''汇总/摘要等可以延后的消息'''
+
+PENDING = 0
+INFLIGHT = 1
+DEAD = 2
+
+
+class MessageQueue(object):
+    """基于 SQLite(WAL) 的本地消息队列, 由工作线程调用 Client.send_msg 发送
+
+    put 只写本地库即返回; 发送成功后才删除记录(至少一次送达), 进程重启后继续发送未完成的消息.
+    数值越小的 priority 越先发送, 高优先级消息不必等待低优先级的积压.
+
+    Examples
+    --------
+    >>> with MessageQueue(client, '/var/lib/app/spool.db', workers=8) as queue:
+    ...     queue.put(toparty='2', content={'content': 'disk full'}, priority=PRIORITY_HIGH)
+    """
+
+    def __init__(self, client, path: str, workers: int = 4, max_attempts: int = 5, retry_delay: float = 5,
+                 lease: float = 120, poll_interval: float = 1, on_result=None):
+        """
+        :param client: Client
+        :param path: 队列文件
+        :param workers: 发送线程数
+        :param max_attempts: 最多发送次数, 超过后标记为失败(可用 dead() 查看)
+        :param retry_delay: 重试间隔(秒), 按发送次数递增
+        :param lease: 发送中的消息超过该秒数未完成(如进程崩溃), 视为未发送
+        :param poll_interval: 空闲时检查队列的间隔(秒)
+        :param on_result: 回调 on_result(id, message: dict, result: dict or Exception), result 的 errcode 非 0 时为部分批次失败, 失败的批次已重新入队
+        """
+        self.client = client
+        self.path: str = path
+        self.workers: int = workers
+        self.max_attempts: int = max_attempts
+        self.retry_delay: float = retry_delay
+        self.lease: float = lease
+        self.poll_interval: float = poll_interval
+        self.on_result = on_result
+
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._running: bool = False
+        self._threads: list = []
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            priority INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            state INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            error TEXT)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS spool_next ON spool (state, priority, id)')
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def put(self, touser='', toparty='', totag='', msgtype: str = 'text', content: dict = {},
+            priority: int = PRIORITY_NORMAL) -> int:
+        """
+        消息入队, 参数同 Client.send_msg
+
+        :param priority: 优先级, 0 最高
+        :return: 消息id
+        """
+        payload = json.dumps({'touser': touser, 'toparty': toparty, 'totag': totag, 'msgtype': msgtype,
+                              'content': content}, ensure_ascii=False)
+        cursor = self._conn().execute('INSERT INTO spool (priority, payload, created_at) VALUES (?, ?, ?)',
+                                      (priority, payload, time.time()))
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def pending(self) -> int:
+        """未发送(含发送中)的消息数"""
+        return self._conn().execute('SELECT COUNT(*) FROM spool WHERE state != ?', (DEAD,)).fetchone()[0]
+
+    def dead(self) -> list:
+        """超过最多发送次数的消息 [(id, message, error)]"""
+        rows = self._conn().execute('SELECT id, payload, error FROM spool WHERE state = ? ORDER BY id', (DEAD,))
+        return [(id, json.loads(payload), error) for id, payload, error in rows]
+
+    def requeue_dead(self) -> int:
+        """失败的消息重新入队"""
+        return self._conn().execute('UPDATE spool SET state = ?, attempts = 0, next_at = 0 WHERE state = ?',
+                                    (PENDING, DEAD)).rowcount
+
+    def _claim(self):
+        """取优先级最高的一条待发送消息, 标记为发送中"""
+        now = time.time()
+        conn = self._conn()
+        with self._claim_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT id, payload, attempts FROM spool '
+                                   'WHERE state IN (?, ?) AND next_at <= ? ORDER BY priority, id LIMIT 1',
+                                   (PENDING, INFLIGHT, now)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE spool SET state = ?, attempts = attempts + 1, next_at = ? WHERE id = ?',
+                                 (INFLIGHT, now + self.lease, row[0]))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return row
+
+    def _deliver(self, id: int, message: dict, attempts: int):
+        try:
+            result = self.client.send_msg(**message)
+        except Exception as e:
+            self._reschedule(id, message, attempts, str(e))
+            result = e
+        else:
+            failed = self._failed_part(message, result)
+            if failed is None:
+                self._conn().execute('DELETE FROM spool WHERE id = ?', (id,))
+            else:
+                # 分批发送时部分批次失败: 只重发失败的批次, 已成功的不再重复发送
+                self._reschedule(id, failed, attempts, '{}: {}'.format(result['errcode'], result.get('errmsg')))
+        if self.on_result is not None:
+            try:
+                self.on_result(id, message, result)
+            except Exception:
+                logger.exception('on_result failed for message %s', id)
+
+    @staticmethod
+    def _failed_part(message: dict, result: dict):
+        """
+        :return: None 为全部成功; 否则为只含失败批次接收人的消息
+        """
+        if result.get('errcode', 0) == 0:
+            return None
+        batches = [b for b in result.get('batches', ()) if b.get('errcode', 0) != 0]
+        if not batches:
+            return message
+        return {**message, **{key: '|'.join(b[key] for b in batches if b[key]) for key in ('touser', 'toparty', 'totag')}}
+
+    def _reschedule(self, id: int, message: dict, attempts: int, error: str):
+        """发送失败, 稍后重发; 超过最多发送次数则标记为失败"""
+        payload = json.dumps(message, ensure_ascii=False)
+        if attempts + 1 >= self.max_attempts:
+            self._conn().execute('UPDATE spool SET state = ?, payload = ?, error = ? WHERE id = ?',
+                                 (DEAD, payload, error, id))
+        else:
+            self._conn().execute('UPDATE spool SET state = ?, payload = ?, next_at = ?, error = ? WHERE id = ?',
+                                 (PENDING, payload, time.time() + self.retry_delay * (attempts + 1), error, id))
+
+    def _work(self):
+        while self._running:
+            try:
+                row = self._claim()
+                if row is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+                id, payload, attempts = row
+                self._deliver(id, json.loads(payload), attempts)
+            except Exception:
+                # 如数据库异常: 发送中的消息在 lease 超时后重新发送, 线程继续工作
+                logger.exception('spool worker error')
+                time.sleep(self.poll_interval)
+
+    def start(self, recover: bool = True):
+        """
+        启动发送线程
+
+        :param recover: 把上次未完成(发送中)的消息立即重新发送; 多个进程共用同一队列文件时应为 False, 由 lease 超时接管
+        """
+        if self._running:
+            return
+        if recover:
+            self._conn().execute('UPDATE spool SET state = ?, next_at = 0 WHERE state = ?', (PENDING, INFLIGHT))
+        self._running = True
+        self._threads = [threading.Thread(target=self._work, name='work_weixin-spool-{}'.format(i), daemon=True)
+                         for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: float = None):
+        """停止发送线程, 正在发送的消息发送完成后退出; 未发送的消息保留在队列中"""
+        self._running = False
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def join(self, timeout: float = None) -> bool:
+        """等待队列中的消息全部发送(失败的除外)
+
+        :return: 是否已全部发送
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending() > 0:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,133 @@
+from .serializer import default_serializer
+
+
+class MessageTemplate(object):
+    """预编译的 send_msg 请求体
+
+    agentid, msgtype, safe 等固定部分预先编码为 bytes, 每次只编码接收人及内容并拼接,
+    不再组装 dict 后整体序列化.
+
+    Examples
+    --------
+    >>> template = MessageTemplate(1000002, 'text')
+    >>> template.render('zhangsan|lisi', '', '', {'content': 'hello'})
+    b'{"agentid":1000002,"msgtype":"text","safe":0,"touser":"zhangsan|lisi","toparty":"","totag":"","text":{"content":"hello"}}'
+    """
+
+    __slots__ = ('msgtype', 'serializer', '_head', '_tail', '_string')
+
+    def __init__(self, agentid, msgtype: str = 'text', safe: int = 0, serializer=None, **extra):
+        """
+        :param agentid: 应用ID
+        :param msgtype: 消息类型, 也是内容的字段名
+        :param safe: 是否保密消息
+        :param serializer: 序列化, 默认 default_serializer()
+        :param extra: 其他固定参数, 如 enable_duplicate_check, duplicate_check_interval
+        """
+        self.msgtype: str = msgtype
+        self.serializer = serializer or default_serializer()
+        static = self.serializer.dumps({'agentid': agentid, 'msgtype': msgtype, 'safe': safe, **extra})
+        self._head: bytes = static[:-1] + b',"touser":'
+        self._tail: bytes = b',' + self.serializer.dumps(msgtype) + b':'
+        # 标准库 json 逐次调用开销大, 接收人无需转义时直接加引号; orjson 本身更快
+        self._string = self._quote if self.serializer.name == 'json' else self.serializer.dumps
+
+    def render(self, touser: str = '', toparty: str = '', totag: str = '', content=None) -> bytes:
+        """
+        :param touser: "|" 连接的 userid(单批, 不超过接口上限)
+        :param content: 消息内容 dict, 或 encode_content 预先编码的 bytes
+        :return: 请求体
+        """
+        if not isinstance(content, bytes):
+            content = self.serializer.dumps(content if content is not None else {})
+        return b''.join((self._head, self._string(touser), b',"toparty":', self._string(toparty), b',"totag":',
+                         self._string(totag), self._tail, content, b'}'))
+
+    def _quote(self, value) -> bytes:
+        if isinstance(value, str) and value.isascii() and value.isprintable() and '"' not in value \
+                and '\\' not in value:
+            return b'"' + value.encode('ascii') + b'"'
+        return self.serializer.dumps(value)
+
+    def encode_content(self, content) -> bytes:
+        """预先编码内容, 同一内容发给多批接收人时只编码一次; 已编码的 bytes 原样返回"""
+        return content if isinstance(content, bytes) else self.serializer.dumps(content)
+
+
+class ContentTemplate(object):
+    """含 {变量} 的消息内容模板, 按接收人渲染为已编码的内容
+
+    预先把内容编码为 json, 按含变量的字符串切分为固定的 bytes 片段及格式串,
+    渲染时只格式化并编码这些字符串后拼接; 渲染结果相同(按字节)的接收人可合并为一次 send_msg.
+
+    Examples
+    --------
+    >>> template = ContentTemplate('textcard', {'title': '周报', 'description': '{dept}的周报已生成',
+    ...                                         'url': 'https://example.com/report?dept={dept_id}'})
+    >>> client.send_bulk(template, {'zhangsan': {'dept': '研发部', 'dept_id': 3}, 'lisi': {...}})
+    """
+
+    _MARK = '\ue000{}\ue001'
+    '''编码前替换含变量字符串的占位(私用区字符)'''
+
+    def __init__(self, msgtype: str, content: dict, serializer=None):
+        """
+        :param msgtype: 消息类型, 如 text, textcard, news, markdown
+        :param content: 消息内容, 其中的字符串(可嵌套在 dict/list 中)可含 str.format 的 {变量}
+        :param serializer: 序列化, 默认 default_serializer()
+        """
+        self.msgtype: str = msgtype
+        self.content: dict = content
+        self.serializer = serializer or default_serializer()
+        self.formats: list = []
+        '''含变量的字符串, 依次位于 _parts 的各片段之间'''
+        encoded = self.serializer.dumps(self._mark(content)).decode('utf-8')
+        parts, rest = [], encoded
+        for i in range(len(self.formats)):
+            head, rest = rest.split('"' + self._MARK.format(i) + '"', 1)
+            parts.append(head.encode('utf-8'))
+        parts.append(rest.encode('utf-8'))
+        self._parts: tuple = tuple(parts)
+
+    def _mark(self, value):
+        if isinstance(value, dict):
+            return {k: self._mark(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._mark(v) for v in value]
+        # 含 { 或 } 的字符串按 str.format 处理(包括 {{ }} 转义)
+        if isinstance(value, str) and ('{' in value or '}' in value):
+            self.formats.append(value)
+            return self._MARK.format(len(self.formats) - 1)
+        return value
+
+    def render(self, variables: dict) -> bytes:
+        """
+        :param variables: 变量 {name: value}
+        :return: 编码后的内容, 可直接传给 send_msg(content=...)
+        """
+        if not self.formats:
+            return self._parts[0]
+        dumps = self.serializer.dumps
+        out = [self._parts[0]]
+        for fmt, part in zip(self.formats, self._parts[1:]):
+            out.append(dumps(fmt.format_map(variables)))
+            out.append(part)
+        return b''.join(out)
+
+    def group(self, recipients, common: dict = None) -> dict:
+        """
+        渲染并按结果分组
+
+        :param recipients: {userid: 变量} 或 [(userid, 变量), ...]; 变量中可用 {userid}
+        :param common: 所有接收人共用的变量
+        :return: {编码后的内容: [userid, ...]}, 保持接收人的先后顺序
+        """
+        if hasattr(recipients, 'items'):
+            recipients = recipients.items()
+        common = common or {}
+        groups: dict = {}
+        render = self.render
+        for userid, variables in recipients:
+            payload = render({**common, 'userid': userid, **(variables or {})})
+            groups.setdefault(payload, []).append(userid)
+        return groups
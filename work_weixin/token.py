@@ -0,0 +1,292 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+def token_key(corpid: str, secret: str) -> str:
+    """token 缓存的键, 不保存 secret 明文"""
+    return '{}:{}'.format(corpid, hashlib.sha1(secret.encode('utf-8')).hexdigest()[:16])
+
+
+class TokenStore(object):
+    """access_token 存储基类
+
+    load/save 读写 (token, expires_at), lock 用于合并并发刷新:
+    持有锁期间其他线程/进程不会同时去请求 gettoken.
+    """
+
+    def load(self, key: str):
+        """:return: (token, expires_at) or None"""
+        raise NotImplementedError
+
+    def save(self, key: str, token: str, expires_at: float):
+        raise NotImplementedError
+
+    def lock(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryTokenStore(TokenStore):
+    """进程内存储, 同进程内的 Client 共用"""
+
+    def __init__(self):
+        self._tokens: dict = {}
+        self._locks: dict = {}
+        self._guard = threading.Lock()
+
+    def load(self, key: str):
+        return self._tokens.get(key)
+
+    def save(self, key: str, token: str, expires_at: float):
+        self._tokens[key] = (token, expires_at)
+
+    def lock(self, key: str):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+class FileTokenStore(TokenStore):
+    """文件存储, 以 flock 文件锁在同一主机的多个进程间共用 token"""
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise ImportError('FileTokenStore requires fcntl (POSIX only)')
+        self.path: str = path
+        self._thread_lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key: str):
+        rec = self._read().get(key)
+        return tuple(rec) if rec else None
+
+    def save(self, key: str, token: str, expires_at: float):
+        data = self._read()
+        data[key] = [token, expires_at]
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.token')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
+
+    @contextlib.contextmanager
+    def lock(self, key: str):
+        with self._thread_lock, open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SQLiteTokenStore(TokenStore):
+    """SQLite 存储, 以 BEGIN IMMEDIATE 写锁在多个进程间共用 token"""
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path: str = path
+        self.timeout: float = timeout
+        self._local = threading.local()
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS access_token (key TEXT PRIMARY KEY, token TEXT, expires_at REAL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def _execute(self, sql: str, args: tuple = ()):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn.execute(sql, args).fetchall()
+        with contextlib.closing(self._connect()) as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def load(self, key: str):
+        rows = self._execute('SELECT token, expires_at FROM access_token WHERE key = ?', (key,))
+        return rows[0] if rows else None
+
+    def save(self, key: str, token: str, expires_at: float):
+        self._execute('INSERT OR REPLACE INTO access_token (key, token, expires_at) VALUES (?, ?, ?)',
+                      (key, token, expires_at))
+
+    @contextlib.contextmanager
+    def lock(self, key: str):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.conn = conn
+            try:
+                yield
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            self._local.conn = None
+            conn.close()
+
+
+default_store = MemoryTokenStore()
+'''进程内默认共用的 token 存储'''
+
+
+class TokenManager(object):
+    """按 expires_in 管理 access_token
+
+    到期前 refresh_margin 秒起在后台提前刷新, 仍返回旧 token;
+    到期前 safety 秒内则同步刷新. 并发刷新只会请求一次 gettoken.
+    """
+
+    def __init__(self, fetch, key: str, store: TokenStore = None, refresh_margin: float = 300, safety: float = 60):
+        """
+        :param fetch: 请求 gettoken 的函数, 返回 (access_token, expires_in)
+        :param key: 缓存键, 见 token_key
+        :param store: token 存储, 默认 default_store
+        :param refresh_margin: 提前刷新的秒数
+        :param safety: 视为已过期的提前秒数
+        """
+        self.fetch = fetch
+        self.key: str = key
+        self.store: TokenStore = store or default_store
+        self.refresh_margin: float = refresh_margin
+        self.safety: float = safety
+        self._token: str = ''
+        self._expires_at: float = 0
+        self._lock = threading.Lock()
+        self._flag_lock = threading.Lock()
+        self._refreshing: bool = False
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def get(self, stale: str = None) -> str:
+        """
+        取 token
+
+        :param stale: 已被接口判定失效的 token, 若仍是当前 token 则强制刷新
+        :return: access_token
+        """
+        cached = self._cached(stale)
+        if cached is None:
+            return self._refresh(stale)
+        if cached:
+            self._refresh_in_background()
+        return self._token
+
+    def _cached(self, stale: str = None):
+        """
+        :return: None 为需要同步刷新; 否则当前 token 可用, True 为需要提前刷新
+        """
+        now = time.time()
+        if stale is None or stale != self._token:
+            if now < self._expires_at - self.refresh_margin:
+                return False
+            if now < self._expires_at - self.safety:
+                return True
+        return None
+
+    def _refresh_in_background(self):
+        with self._flag_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background, daemon=True).start()
+
+    def _background(self):
+        try:
+            self._refresh(early=True)
+        except Exception:
+            pass  # 旧 token 仍有效, 下次取用时再试
+        finally:
+            self._refreshing = False
+
+    def _valid(self, token: str, expires_at: float, stale: str, early: bool) -> bool:
+        margin = self.refresh_margin if early else self.safety
+        return bool(token) and token != stale and time.time() < expires_at - margin
+
+    def _refresh(self, stale: str = None, early: bool = False) -> str:
+        with self._lock:
+            # 等锁期间可能已被其他线程刷新
+            if self._valid(self._token, self._expires_at, stale, early):
+                return self._token
+            with self.store.lock(self.key):
+                # 其他进程可能已刷新
+                rec = self.store.load(self.key)
+                if rec is not None and self._valid(rec[0], rec[1], stale, early):
+                    token, expires_at = rec
+                else:
+                    token, expires_in = self.fetch()
+                    expires_at = time.time() + float(expires_in)
+                    self.store.save(self.key, token, expires_at)
+            self._token, self._expires_at = token, expires_at
+            return token
+
+
+class AsyncTokenManager(TokenManager):
+    """TokenManager 的 asyncio 版本, fetch 为协程函数, get 需 await
+
+    缓存及提前刷新同 TokenManager, 可与 Client 共用 TokenStore; 提前刷新为事件循环中的任务,
+    同一事件循环内并发刷新只请求一次 gettoken. 请求 gettoken 期间不持有 store 的锁, 以免阻塞事件循环,
+    因此多个进程可能各请求一次.
+    """
+
+    def __init__(self, fetch, key: str, store: TokenStore = None, refresh_margin: float = 300, safety: float = 60):
+        """
+        :param fetch: 请求 gettoken 的协程函数, 返回 (access_token, expires_in)
+        """
+        super().__init__(fetch, key, store, refresh_margin, safety)
+        self._async_lock: asyncio.Lock = None
+        self._task: asyncio.Task = None
+
+    async def get(self, stale: str = None) -> str:
+        """
+        取 token
+
+        :param stale: 已被接口判定失效的 token, 若仍是当前 token 则强制刷新
+        :return: access_token
+        """
+        cached = self._cached(stale)
+        if cached is None:
+            return await self._refresh(stale)
+        if cached and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._background())
+        return self._token
+
+    async def _background(self):
+        try:
+            await self._refresh(early=True)
+        except Exception:
+            pass  # 旧 token 仍有效, 下次取用时再试
+
+    async def _refresh(self, stale: str = None, early: bool = False) -> str:
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if self._valid(self._token, self._expires_at, stale, early):
+                return self._token
+            # 其他进程或共用 store 的 Client 可能已刷新
+            rec = self.store.load(self.key)
+            if rec is not None and self._valid(rec[0], rec[1], stale, early):
+                token, expires_at = rec
+            else:
+                token, expires_in = await self.fetch()
+                expires_at = time.time() + float(expires_in)
+                with self.store.lock(self.key):
+                    self.store.save(self.key, token, expires_at)
+            self._token, self._expires_at = token, expires_at
+            return token
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import consts as c, exceptions
+
+
+class Transport(object):
+    """基于 requests.Session 的连接池, 所有请求复用 keep-alive 连接"""
+
+    def __init__(self, base_url: str = c.API_URL, pool_size: int = 10, connect_timeout: float = 3.05,
+                 read_timeout: float = 10, deadline: float = None, keep_alive: bool = True, preconnect: bool = False):
+        """
+        :param base_url: 接口地址
+        :param pool_size: 连接池大小(每个host的最大连接数)
+        :param connect_timeout: 建立连接超时(秒)
+        :param read_timeout: 读取超时(秒)
+        :param deadline: 单次调用的总时限(秒), None 为不限制
+        :param keep_alive: 是否保持长连接
+        :param preconnect: 是否在后台预先建立连接
+        """
+        self.base_url: str = base_url
+        self.connect_timeout: float = connect_timeout
+        self.read_timeout: float = read_timeout
+        self.deadline: float = deadline
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        if preconnect:
+            threading.Thread(target=self._preconnect, daemon=True).start()
+
+    def _preconnect(self):
+        """预先完成 TCP+TLS 握手, 连接放回池中供后续请求使用"""
+        try:
+            self.session.head(self.base_url, timeout=(self.connect_timeout, self.read_timeout))
+        except requests.RequestException:
+            pass
+
+    def _timeout(self, started: float, deadline: float):
+        if deadline is None:
+            return self.connect_timeout, self.read_timeout
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            raise exceptions.WorkRequestException('Deadline exceeded: {}s'.format(deadline))
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def request(self, method: str, url: str, headers: dict = None, data=None, deadline: float = None, **kwargs):
+        """
+        发送请求
+
+        :param method: c.GET or c.POST
+        :param url: 完整url 或以 / 开头的请求路径
+        :param deadline: 本次调用的总时限(秒), 默认使用 self.deadline
+        :return: requests.Response
+        """
+        if url.startswith('/'):
+            url = self.base_url + url
+        deadline = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        stream = kwargs.pop('stream', False)
+        try:
+            response = self.session.request(method, url, headers=headers, data=data,
+                                            timeout=self._timeout(started, deadline),
+                                            stream=stream or deadline is not None, **kwargs)
+            if deadline is not None and not stream:
+                self._read(response, started, deadline)
+        except requests.Timeout as e:
+            raise exceptions.WorkRequestException('Request timeout: {}'.format(e))
+        except requests.ConnectionError as e:
+            raise exceptions.WorkRequestException('Connection error: {}'.format(e))
+        except requests.RequestException as e:
+            # 如内容不完整(ChunkedEncodingError), 同样视为网络错误, 可按策略重试
+            raise exceptions.WorkRequestException('Request error: {}'.format(e))
+        return response
+
+    @staticmethod
+    def _read(response, started: float, deadline: float, chunk_size: int = 1 << 16):
+        """分块读取内容, 超过总时限时中断
+
+        已完整收到的响应不再视为超时: 如 message/send 已发送成功, 调用方不应因此重发.
+        """
+        length = response.headers.get(c.CONTENT_LENGTH)
+        length = int(length) if length and length.isdigit() else None
+        chunks, received = [], 0
+        for chunk in response.iter_content(chunk_size):
+            chunks.append(chunk)
+            received += len(chunk)
+            if (length is None or received < length) and time.monotonic() - started > deadline:
+                response.close()
+                raise exceptions.WorkRequestException('Deadline exceeded: {}s'.format(deadline))
+        response._content = b''.join(chunks)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
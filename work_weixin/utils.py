@@ -2,6 +2,7 @@ import hmac
 import base64
 import time
 import datetime
+import tempfile
 from . import consts as c
 
 
@@ -46,3 +47,43 @@ def signature(timestamp, method, request_path, body, secret_key):
     mac = hmac.new(bytes(secret_key, encoding='utf8'), bytes(message, encoding='utf-8'), digestmod='sha256')
     d = mac.digest()
     return base64.b64encode(d)
+
+
+def spool_iterable(chunks, max_size: int = 1 << 20):
+    """把分块的字节迭代器写入临时文件(小于 max_size 时留在内存), 以便得到长度后流式上传
+
+    :return: 已回到开头的文件对象
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=max_size)
+    for chunk in chunks:
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+
+class UploadReader(object):
+    """包装可 seek 的文件对象, 供 MultipartEncoder 分块读取
+
+    len 为剩余字节数; 可选回调 progress(已读字节, 总字节, 每秒字节)
+    """
+
+    def __init__(self, f, progress=None):
+        self._f = f
+        start = f.tell()
+        self.total: int = f.seek(0, 2) - start
+        f.seek(start)
+        self._progress = progress
+        self._read: int = 0
+        self._started: float = time.monotonic()
+
+    @property
+    def len(self) -> int:
+        return self.total - self._read
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self._f.read(size)
+        self._read += len(chunk)
+        if self._progress is not None:
+            elapsed = time.monotonic() - self._started
+            self._progress(self._read, self.total, self._read / elapsed if elapsed > 0 else 0)
+        return chunk
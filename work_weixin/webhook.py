@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from urllib.parse import urlparse, parse_qs
+
+from requests_toolbelt import MultipartEncoder
+
+from . import consts as c, exceptions
+from .client import Client
+from .retry import RetryPolicy
+from .serializer import default_serializer
+from .transport import Transport
+
+ERR_FREQ_OUT_OF_LIMIT = 45009
+'''机器人发送超过频率限制'''
+
+
+class _Robot(object):
+    """一个机器人 key 及其最近的发送时间(滑动窗口)"""
+
+    __slots__ = ('key', 'count', 'period', 'sent', 'cooldown_until', 'stats')
+
+    def __init__(self, key: str, limit: tuple):
+        self.key: str = key
+        self.count, self.period = limit
+        self.sent: deque = deque(maxlen=self.count)
+        self.cooldown_until: float = 0
+        '''被限流(45009)后暂停到此时'''
+        self.stats: dict = {'sent': 0, 'throttled': 0}
+
+    def wait(self, now: float) -> float:
+        """距下一次可发送的秒数"""
+        wait = self.cooldown_until - now
+        if len(self.sent) == self.count:
+            wait = max(wait, self.sent[0] + self.period - now)
+        return max(wait, 0)
+
+
+class _Message(object):
+    __slots__ = ('msgtype', 'content', 'file', 'future', 'attempts', 'media_ids', 'not_before')
+
+    def __init__(self, msgtype: str, content: dict, file: tuple = None):
+        self.msgtype: str = msgtype
+        self.content: dict = content
+        self.file: tuple = file
+        '''file 消息的 (文件名, 内容), 发送时由发送的机器人上传'''
+        self.future: Future = Future()
+        self.attempts: int = 0
+        self.media_ids: dict = {}
+        '''{key: media_id}, media_id 只能由上传的机器人使用'''
+        self.not_before: float = 0
+        '''重试时退避到此时再发送'''
+
+
+class WebhookSender(object):
+    """群机器人消息, 多个机器人(同一群)分担发送
+
+    每个机器人约 20条/分, 每个 key 一个发送线程, 按滑动窗口自行控制频率, 有额度时从共用队列取下一条消息,
+    吞吐量随 key 的数量增加; 所有机器人都无额度时消息在队列中等待, 不丢弃.
+    某个机器人仍被限流(45009)时, 消息放回队首由其他机器人发送, 该机器人暂停一个周期.
+
+    Examples
+    --------
+    >>> with WebhookSender(['KEY1', 'KEY2', 'KEY3']) as sender:
+    ...     sender.send_text('数据库连接超时', mentioned_list=['@all'])
+    ...     future = sender.send_markdown('**部署完成**')
+    ...     future.result()  # 等待发送结果
+    """
+
+    def __init__(self, keys, transport: Transport = None, limit: tuple = (20, 60), max_queue: int = 0,
+                 retry_policy: RetryPolicy = None, serializer=None):
+        """
+        :param keys: 机器人的 key, 也可为完整的 webhook 地址
+        :param transport: 默认 Transport(pool_size=len(keys))
+        :param limit: 每个机器人的频率上限 (条数, 秒)
+        :param max_queue: 队列上限, 队列满时 send 阻塞(背压); 0 为不限
+        :param retry_policy: 系统繁忙、网络错误时的重试策略, 默认 RetryPolicy()
+        :param serializer: 请求及返回的 json 序列化, 默认 default_serializer()
+        """
+        if not keys:
+            raise ValueError('at least one webhook key is required')
+        self.robots: list = [_Robot(self._parse_key(key), limit) for key in keys]
+        self.transport: Transport = transport or Transport(pool_size=len(self.robots))
+        self.max_queue: int = max_queue
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy()
+        self.serializer = serializer or default_serializer()
+        self.stats: dict = {'sent': 0, 'failed': 0, 'throttled': 0, 'retried': 0}
+        self._queue: deque = deque()
+        self._delayed: list = []
+        '''退避中的重试, 堆 [(not_before, 序号, message)]'''
+        self._seq = itertools.count()
+        self._inflight: int = 0
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads: list = []
+
+    @staticmethod
+    def _parse_key(key: str) -> str:
+        """https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=KEY -> KEY"""
+        if '?' in key:
+            return parse_qs(urlparse(key).query)['key'][0]
+        return key
+
+    def send(self, msgtype: str, content: dict, block: bool = True, timeout: float = None) -> Future:
+        """
+        消息入队
+
+        :param msgtype: text, markdown, image, news, file 等
+        :param content: 消息内容, 如 {'content': 'hello'}
+        :param block: 队列满时是否等待, 不等待则抛出 queue.Full
+        :param timeout: 等待的秒数
+        :return: Future, 结果为接口返回的 dict, 或 WorkException 等异常
+        """
+        return self._put(_Message(msgtype, content), block, timeout)
+
+    def send_text(self, content: str, mentioned_list: list = None, mentioned_mobile_list: list = None) -> Future:
+        """
+        发送文本消息
+
+        :param content: 不超过2048字节
+        :param mentioned_list: 提醒的 userid, '@all' 为所有人
+        :param mentioned_mobile_list: 提醒的手机号
+        """
+        text: dict = {'content': content}
+        if mentioned_list:
+            text['mentioned_list'] = mentioned_list
+        if mentioned_mobile_list:
+            text['mentioned_mobile_list'] = mentioned_mobile_list
+        return self.send('text', text)
+
+    def send_markdown(self, content: str) -> Future:
+        """发送 markdown 消息, 不超过4096字节"""
+        return self.send('markdown', {'content': content})
+
+    def send_image(self, file_name: str = None, data: bytes = None) -> Future:
+        """
+        发送图片(jpg/png, 不超过2M)
+
+        :param data: 图片内容, 代替读取 file_name
+        """
+        if data is None:
+            with open(file_name, 'rb') as f:
+                data = f.read()
+        return self.send('image', {'base64': base64.b64encode(data).decode('ascii'),
+                                   'md5': hashlib.md5(data).hexdigest()})
+
+    def send_file(self, file_name: str, data: bytes = None) -> Future:
+        """
+        发送文件(不超过20M), 由发送的机器人上传后发送
+
+        :param data: 文件内容, 代替读取 file_name; 此时 file_name 只作为文件名
+        """
+        if data is None:
+            with open(file_name, 'rb') as f:
+                data = f.read()
+        return self._put(_Message('file', {}, (os.path.split(file_name)[1], data)))
+
+    def _put(self, message: _Message, block: bool = True, timeout: float = None) -> Future:
+        with self._cond:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                if not block or not self._cond.wait_for(lambda: len(self._queue) < self.max_queue, timeout):
+                    raise queue.Full
+            self._queue.append(message)
+            self._cond.notify_all()
+        return message.future
+
+    def pending(self) -> int:
+        """队列中及发送中的消息数"""
+        with self._cond:
+            return len(self._queue) + len(self._delayed) + self._inflight
+
+    def _work(self, robot: _Robot):
+        while not self._stopped.is_set():
+            wait = robot.wait(time.monotonic())
+            if wait > 0:
+                self._stopped.wait(wait)
+                continue
+            with self._cond:
+                while not self._stopped.is_set():
+                    now = time.monotonic()
+                    # 退避结束的重试排到队尾
+                    while self._delayed and self._delayed[0][0] <= now:
+                        self._queue.append(heapq.heappop(self._delayed)[2])
+                    if self._queue:
+                        break
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                if self._stopped.is_set():
+                    return
+                message = self._queue.popleft()
+                self._inflight += 1
+                self._cond.notify_all()
+            try:
+                if message.future.running() or message.future.set_running_or_notify_cancel():
+                    self._deliver(robot, message)
+            except Exception as e:
+                # 如序列化失败, 不让发送线程退出
+                self._count('failed')
+                message.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, robot: _Robot, message: _Message):
+        try:
+            result = self._post(robot, message)
+        except (exceptions.WorkException, exceptions.WorkRequestException) as e:
+            if isinstance(e, exceptions.WorkException) and e.code == ERR_FREQ_OUT_OF_LIMIT:
+                # 服务端的计数与本地不一致(如 key 也被其他进程使用): 暂停该机器人, 消息交给其他机器人
+                robot.cooldown_until = time.monotonic() + robot.period
+                robot.stats['throttled'] += 1
+                self._requeue(message, 'throttled', front=True)
+            elif self.retry_policy.should_retry(e, c.POST, message.attempts):
+                # 按退避时间延后, 系统繁忙时不会在几毫秒内用完重试次数
+                message.not_before = time.monotonic() + self.retry_policy.delay(message.attempts)
+                message.attempts += 1
+                self._requeue(message, 'retried')
+            else:
+                self._count('failed')
+                message.future.set_exception(e)
+            return
+        robot.stats['sent'] += 1
+        self._count('sent')
+        message.future.set_result(result)
+
+    def _count(self, name: str):
+        with self._cond:
+            self.stats[name] += 1
+
+    def _requeue(self, message: _Message, reason: str, front: bool = False):
+        with self._cond:
+            self.stats[reason] += 1
+            if message.not_before > time.monotonic():
+                heapq.heappush(self._delayed, (message.not_before, next(self._seq), message))
+            elif front:
+                self._queue.appendleft(message)
+            else:
+                self._queue.append(message)
+            self._cond.notify_all()
+
+    def _post(self, robot: _Robot, message: _Message) -> dict:
+        content = message.content
+        if message.file is not None:
+            media_id = message.media_ids.get(robot.key)
+            if media_id is None:
+                media_id = message.media_ids[robot.key] = self._upload(robot.key, *message.file)
+            content = {'media_id': media_id}
+        data = self.serializer.dumps({'msgtype': message.msgtype, message.msgtype: content})
+        try:
+            response = self.transport.request(c.POST, c.WEBHOOK_SEND + '?key=' + robot.key,
+                                              headers={c.CONTENT_TYPE: c.APPLICATION_JSON}, data=data)
+        finally:
+            # 服务端在请求到达时计数, 以收到响应的时间计入窗口, 不会早于服务端
+            robot.sent.append(time.monotonic())
+        return Client._parse_response(response, self.serializer.loads)
+
+    def _upload(self, key: str, file_name: str, data: bytes) -> str:
+        m = MultipartEncoder({'media': (file_name, data, 'application/octet-stream')})
+        response = self.transport.request(c.POST, c.WEBHOOK_UPLOAD + '?key={}&type=file'.format(key),
+                                          headers={c.CONTENT_TYPE: m.content_type}, data=m)
+        return Client._parse_response(response, self.serializer.loads)['media_id']
+
+    def start(self):
+        """启动发送线程, 每个机器人一个"""
+        if not self._threads:
+            self._stopped.clear()
+            self._threads = [threading.Thread(target=self._work, args=(robot,), daemon=True,
+                                              name='work_weixin-webhook-{}'.format(i))
+                             for i, robot in enumerate(self.robots)]
+            for t in self._threads:
+                t.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """停止发送线程, 正在发送的消息完成后退出; 未发送的消息保留在队列中, 可再次 start"""
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def join(self, timeout: float = None) -> bool:
+        """等待队列中的消息全部发送
+
+        :return: 是否已全部发送
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._delayed and self._inflight == 0, timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.join()
+        self.stop()